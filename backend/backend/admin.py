@@ -0,0 +1,18 @@
+from django.contrib import admin
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Просмотр без правки.
+
+    Для связей, которые меняются только через RelationQuerySet: он же
+    обновляет счётчики, кэш токена и списки покупок.
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,109 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def load_relation_ids(user):
+    # Флаги is_favorited, is_in_shopping_cart и is_subscribed для любых
+    # строк ответа проверяются по этим множествам, без запроса на строку
+    user.favorite_ids = frozenset(
+        user.favorite_items.values_list('recipe_id', flat=True))
+    user.cart_ids = frozenset(
+        user.shoppingcartitem_items.values_list('recipe_id', flat=True))
+    user.subscription_ids = frozenset(
+        user.subscription_items.values_list('author_id', flat=True))
+
+
+RELATION_IDS = ('favorite_ids', 'cart_ids', 'subscription_ids')
+
+
+class TokenCache:
+    """token -> пользователь в общем кэше.
+
+    Хранятся только id, is_active и множества id связей, ключ - хэш
+    токена. Кэша в памяти процесса нет: сброс сразу виден всем
+    процессам. По user_id в кэше находится хэш токена.
+    """
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def token_key(digest):
+        return f'auth-token:{digest}'
+
+    @staticmethod
+    def user_key(user_id):
+        return f'auth-user:{user_id}'
+
+    def get(self, token):
+        return cache.get(self.token_key(self.digest(token)))
+
+    def set(self, token, user):
+        digest = self.digest(token)
+        entry = {'id': user.pk, 'is_active': user.is_active}
+        entry.update((name, getattr(user, name)) for name in RELATION_IDS)
+        cache.set_many({
+            self.token_key(digest): entry,
+            self.user_key(user.pk): digest,
+        }, settings.TOKEN_CACHE_TIMEOUT)
+
+    def forget(self, token):
+        cache.delete(self.token_key(self.digest(token)))
+
+    def forget_user(self, user_id):
+        digest = cache.get(self.user_key(user_id))
+        keys = [self.user_key(user_id)]
+        if digest is not None:
+            keys.append(self.token_key(digest))
+        cache.delete_many(keys)
+
+    def invalidate_user(self, user_id):
+        # Сбрасываем и сразу, и после коммита: иначе параллельный запрос
+        # успеет закэшировать данные из ещё не закоммиченной транзакции
+        self.forget_user(user_id)
+        transaction.on_commit(lambda: self.forget_user(user_id))
+
+
+token_cache = TokenCache()
+
+
+def build_user(entry):
+    # Остальные поля отложены и читаются из базы одним запросом при
+    # первом обращении (CustomUser.refresh_from_db), поэтому профиль
+    # и счётчики всегда свежие
+    User = get_user_model()
+    user = User.from_db(
+        None, ['id', 'is_active'], [entry['id'], entry['is_active']])
+    for name in RELATION_IDS:
+        setattr(user, name, entry[name])
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе на каждый запрос.
+
+    К пользователю приложены favorite_ids, cart_ids и subscription_ids.
+    Запись сбрасывается при выходе, входе, изменении пользователя и его
+    избранного, корзины или подписок (см. users.signals).
+    """
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            load_relation_ids(user)
+            token_cache.set(key, user)
+            return user, token
+        if not entry['is_active']:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return build_user(entry), self.get_model()(
+            key=key, user_id=entry['id'])
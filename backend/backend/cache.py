@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+def get_versions(*namespaces):
+    keys = [f'version:{namespace}' for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(*namespaces):
+    keys = [f'version:{namespace}' for namespace in namespaces]
+    versions = await cache.aget_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*namespaces):
+    # Новая версия делает недействительными все ключи, собранные
+    # со старой; сами записи вытеснит кэш
+    version = time.time_ns()
+    cache.set_many(
+        {f'version:{namespace}': version for namespace in namespaces}, None)
+
+
+def invalidate(*namespaces):
+    # Сбрасываем после коммита, иначе параллельный запрос успеет
+    # закэшировать старые данные под новой версией
+    transaction.on_commit(lambda: bump_versions(*namespaces))
+
+
+class LocalCache:
+    """LRU в памяти процесса: size записей, каждая живёт timeout секунд."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+            self.entries.pop(key, None)
+        return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.timeout
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_values(self, predicate):
+        with self.lock:
+            for key, (_, value) in list(self.entries.items()):
+                if predicate(value):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CachedReadMixin:
+    """Кэширует ответы list/retrieve для анонимных пользователей.
+
+    Рассчитан на async viewset (см. backend.views.AsyncReadMixin).
+    get_list_namespaces позволяет сузить сброс кэша для отфильтрованных
+    списков.
+    """
+
+    cache_namespace = None
+
+    def get_list_namespaces(self):
+        return [self.cache_namespace]
+
+    async def list(self, request, *args, **kwargs):
+        return await self.cached_response(
+            self.get_list_namespaces(), super().list,
+            request, *args, **kwargs)
+
+    async def retrieve(self, request, *args, **kwargs):
+        namespace = f'{self.cache_namespace}:{kwargs[self.lookup_field]}'
+        return await self.cached_response(
+            [namespace], super().retrieve, request, *args, **kwargs)
+
+    async def cached_response(self, namespaces, handler, request,
+                              *args, **kwargs):
+        if request.user.is_authenticated:
+            return await handler(request, *args, **kwargs)
+
+        versions = await aget_versions(*namespaces)
+        path = request.get_full_path()
+        key = 'response:' + hashlib.md5(
+            f'{path}:{versions}'.encode()).hexdigest()
+
+        entry = await cache.aget(key)
+        if entry is None:
+            response = await handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            etag = hashlib.md5(JSONRenderer().render(response.data))
+            entry = {'data': response.data, 'etag': f'"{etag.hexdigest()}"'}
+            await cache.aset(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+
+        if request.headers.get('If-None-Match') == entry['etag']:
+            response = Response(status=304)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        return response
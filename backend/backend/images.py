@@ -0,0 +1,147 @@
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.utils.encoding import filepath_to_uri
+from PIL import Image
+
+from backend.cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_THUMBNAIL_WORKERS,
+    thread_name_prefix='thumbnails'
+)
+
+# Найденные миниатюры: файл с тем же именем уже не пропадёт. Ненайденные
+# не запоминаются и проверяются снова при следующем запросе
+created_thumbnails = LocalCache(
+    settings.IMAGE_THUMBNAIL_CACHE_SIZE,
+    settings.IMAGE_THUMBNAIL_CACHE_TIMEOUT
+)
+
+
+def thumbnail_name(name, size):
+    root, _ = posixpath.splitext(name)
+    extension = settings.IMAGE_THUMBNAIL_FORMAT.lower()
+    return f'thumbnails/{root}.{size}.{extension}'
+
+
+def make_thumbnails(name, kind):
+    sizes = settings.IMAGE_THUMBNAIL_SIZES[kind]
+    missing = {
+        size: dimensions for size, dimensions in sizes.items()
+        if not default_storage.exists(thumbnail_name(name, size))
+    }
+    if not missing or not default_storage.exists(name):
+        return
+
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    if settings.IMAGE_THUMBNAIL_FORMAT == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    for size, dimensions in missing.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(dimensions)
+        buffer = io.BytesIO()
+        thumbnail.save(
+            buffer,
+            format=settings.IMAGE_THUMBNAIL_FORMAT,
+            quality=settings.IMAGE_THUMBNAIL_QUALITY
+        )
+        default_storage.save(
+            thumbnail_name(name, size), ContentFile(buffer.getvalue()))
+        created_thumbnails.set(thumbnail_name(name, size), True)
+
+
+def thumbnail_exists(name):
+    if created_thumbnails.get(name):
+        return True
+    exists = default_storage.exists(name)
+    if exists:
+        created_thumbnails.set(name, True)
+    return exists
+
+
+def ready_thumbnails(name, kind):
+    """Имена уже созданных миниатюр по размерам.
+
+    Миниатюры может не быть: задача ещё в очереди или упала, процесс
+    завершился раньше, изображение загружено до их появления (см. команду
+    make_thumbnails). Такие размеры в ответ не попадают.
+    """
+    names = {
+        size: thumbnail_name(name, size)
+        for size in settings.IMAGE_THUMBNAIL_SIZES[kind]
+    }
+    return {
+        size: thumbnail for size, thumbnail in names.items()
+        if thumbnail_exists(thumbnail)
+    }
+
+
+def run_make_thumbnails(name, kind):
+    try:
+        make_thumbnails(name, kind)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+
+
+def schedule_thumbnails(name, kind):
+    # Файл становится доступен другим потокам только после коммита
+    transaction.on_commit(
+        lambda: executor.submit(run_make_thumbnails, name, kind))
+
+
+def thumbnail_urls(image, kind, request=None):
+    if not image:
+        return None
+    urls = {}
+    for size, name in ready_thumbnails(image.name, kind).items():
+        url = default_storage.url(name)
+        urls[size] = request.build_absolute_uri(url) if request else url
+    return urls or None
+
+
+class MediaUrls:
+    """Абсолютные URL файлов для ответов API.
+
+    build_absolute_uri вызывается один раз на запрос: к префиксу MEDIA_URL
+    дописывается путь файла так же, как это делает FileSystemStorage.url.
+    Для других хранилищ URL по-прежнему строит само хранилище.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        self.prefix = None
+        if isinstance(default_storage, FileSystemStorage):
+            base_url = default_storage.base_url
+            self.prefix = (
+                request.build_absolute_uri(base_url) if request else base_url)
+
+    def url(self, name):
+        if self.prefix is not None:
+            return self.prefix + filepath_to_uri(name).lstrip('/')
+        url = default_storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request else url
+
+    def file_url(self, file):
+        return self.url(file.name) if file else None
+
+    def thumbnails(self, file, kind):
+        if not file:
+            return None
+        return {
+            size: self.url(name)
+            for size, name in ready_thumbnails(file.name, kind).items()
+        } or None
@@ -0,0 +1,204 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async)
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('backend.profiler')
+
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+\b'), '?'),
+    (re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)'), '(...)'),
+    (re.compile(r'%s'), '?'),
+]
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class QueryProfile:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        return {
+            sql: count for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        }
+
+
+@contextmanager
+def serializer_timing(request):
+    """Засекает построение ответа для метрики serialize.
+
+    Запросы к базе внутри блока остаются в метрике db.
+    """
+    profiler = getattr(request, '_profiler', None)
+    if profiler is None:
+        yield
+        return
+    profile = profiler['profile']
+    started, db = time.perf_counter(), profile.duration
+    try:
+        yield
+    finally:
+        profiler['serialize'] += (
+            time.perf_counter() - started - (profile.duration - db))
+
+
+class QueryProfilerMiddleware:
+    """Считает запросы к базе и время обработки запроса.
+
+    Результат уходит в заголовок Server-Timing и в строку лога
+    backend.profiler. Время сериализации считается там, где ответ
+    строится внутри serializer_timing (backend.views.AsyncReadMixin),
+    у остальных view оно входит в app. Профилируется доля SAMPLE_RATE
+    запросов. В режиме STRICT превышение бюджета запросов (атрибут
+    query_budget у view или QUERY_BUDGET) приводит к исключению, что
+    роняет тесты.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @property
+    def config(self):
+        return settings.QUERY_PROFILER
+
+    def is_sampled(self):
+        return (self.config['ENABLED']
+                and random.random() < self.config['SAMPLE_RATE'])
+
+    def wrap_connections(self, stack, profile):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        profile = QueryProfile()
+        request._profiler = self.start(profile)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.wrap_connections(stack, profile)
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        self.report(request, response, profile, total)
+        return response
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        # Под ASGI запросы к базе идут в отдельном потоке запроса,
+        # обёртка ставится на соединения именно этого потока
+        profile = QueryProfile()
+        request._profiler = self.start(profile)
+        started = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        total = time.perf_counter() - started
+
+        self.report(request, response, profile, total)
+        return response
+
+    def start(self, profile):
+        return {
+            'budget': self.config['QUERY_BUDGET'],
+            'profile': profile,
+            'serialize': 0.0,
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_profiler'):
+            view_class = getattr(view_func, 'cls', None)
+            budget = getattr(view_class, 'query_budget', None)
+            if budget is not None:
+                request._profiler['budget'] = budget
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после view: засекаем время рендера
+        if hasattr(request, '_profiler'):
+            request._profiler['render_started'] = time.perf_counter()
+
+            def finish(response):
+                request._profiler['render'] = (
+                    time.perf_counter()
+                    - request._profiler['render_started'])
+            response.add_post_render_callback(finish)
+        return response
+
+    def report(self, request, response, profile, total):
+        render = request._profiler.get('render', 0.0)
+        serialize = request._profiler['serialize']
+        app = max(total - profile.duration - serialize - render, 0.0)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.duration * 1000:.1f};'
+            f'desc="{profile.count} queries"',
+            f'app;dur={app * 1000:.1f}',
+            f'serialize;dur={serialize * 1000:.1f}',
+            f'render;dur={render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        duplicates = profile.duplicates(self.config['DUPLICATE_THRESHOLD'])
+        budget = request._profiler['budget']
+        over_budget = budget is not None and profile.count > budget
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.count,
+            'db_ms': round(profile.duration * 1000, 1),
+            'app_ms': round(app * 1000, 1),
+            'serialize_ms': round(serialize * 1000, 1),
+            'render_ms': round(render * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'duplicates': duplicates,
+        }
+        level = logging.WARNING if duplicates or over_budget else logging.INFO
+        logger.log(level, json.dumps(record, ensure_ascii=False))
+
+        if over_budget and self.config['STRICT']:
+            raise QueryBudgetExceeded(
+                f'{request.method} {request.path}: {profile.count} '
+                f'запросов при бюджете {budget}')
@@ -0,0 +1,196 @@
+import base64
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    # Оценка планировщика PostgreSQL вместо полного COUNT(*)
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """LimitOffset по умолчанию, постраничный обход по ключу с ?cursor=.
+
+    Курсор хранит значения полей cursor_ordering последней строки
+    страницы, следующая страница выбирается условием по этим полям,
+    поэтому её стоимость не зависит от глубины. ?count=none отключает
+    подсчёт общего количества, ?count=estimate берёт оценку планировщика.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cursor_ordering = ('id',)
+    cursor_page_size = 10
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.start(queryset, request, view):
+            return None
+        if self.count_method == 'exact':
+            self.count = self.get_count(queryset)
+        elif self.count_method == 'estimate':
+            self.count = estimate_count(queryset)
+        if self.is_past_end():
+            return []
+        return self.make_page(list(self.get_page_queryset(queryset)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # То же для async view: запросы через async ORM
+        if not self.start(queryset, request, view):
+            return None
+        if not isinstance(queryset, QuerySet):
+            return self.paginate_queryset(queryset, request, view)
+        if self.count_method == 'exact':
+            self.count = await queryset.acount()
+        elif self.count_method == 'estimate':
+            self.count = await sync_to_async(estimate_count)(queryset)
+        if self.is_past_end():
+            return []
+        page = self.get_page_queryset(queryset)
+        return self.make_page([row async for row in page])
+
+    def start(self, queryset, request, view):
+        self.request = request
+        self.view = view
+        self.cursor_mode = (
+            self.cursor_query_param in request.query_params
+            and isinstance(queryset, QuerySet)
+        )
+        count_mode = request.query_params.get(self.count_query_param)
+        self.exact_count = (
+            not self.cursor_mode and count_mode not in ('none', 'estimate'))
+
+        self.limit = self.get_limit(request)
+        if self.limit is None and self.cursor_mode:
+            self.limit = self.cursor_page_size
+        if self.limit is None:
+            return False
+
+        self.count = None
+        if count_mode == 'estimate' and isinstance(queryset, QuerySet):
+            self.count_method = 'estimate'
+        elif count_mode == 'none' or (
+                self.cursor_mode and count_mode != 'exact'):
+            self.count_method = None
+        else:
+            self.count_method = 'exact'
+        if not self.cursor_mode:
+            self.offset = self.get_offset(request)
+        return True
+
+    def is_past_end(self):
+        if not self.exact_count:
+            return False
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        return self.count == 0 or self.offset > self.count
+
+    def get_page_queryset(self, queryset):
+        if self.cursor_mode:
+            self.ordering = getattr(
+                self.view, 'cursor_ordering', None) or self.cursor_ordering
+            queryset = queryset.order_by(*self.ordering)
+            cursor = self.request.query_params[self.cursor_query_param]
+            if cursor:
+                queryset = queryset.filter(self.get_cursor_filter(cursor))
+            return queryset[:self.limit + 1]
+        if self.exact_count:
+            return queryset[self.offset:self.offset + self.limit]
+        # Лишняя строка показывает, есть ли следующая страница
+        return queryset[self.offset:self.offset + self.limit + 1]
+
+    def make_page(self, rows):
+        if self.exact_count:
+            return rows
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.cursor_mode:
+            self.next_cursor = self.encode_cursor(rows[-1]) if rows else None
+        return rows
+
+    def get_cursor_filter(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, row):
+        values = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if self.exact_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.cursor_mode:
+            return replace_query_param(
+                url, self.cursor_query_param, self.next_cursor)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(
+            url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.cursor_mode:
+            # Бесконечная лента листается только вперёд
+            return None
+        if self.exact_count:
+            return super().get_previous_link()
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if self.offset - self.limit <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(
+            url, self.offset_query_param, self.offset - self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+    def get_html_context(self):
+        if not self.exact_count:
+            return {'previous_url': self.get_previous_link(),
+                    'next_url': self.get_next_link(),
+                    'page_links': []}
+        return super().get_html_context()
@@ -0,0 +1,112 @@
+from django.db import connections, models
+from django.utils import timezone
+
+from backend.authentication import token_cache
+
+
+class RelationQuerySet(models.QuerySet):
+    """Связи пользователя с объектом: избранное, корзина, подписки.
+
+    add и remove выполняют один запрос и сообщают, изменилась ли связь,
+    поэтому повторный клик не требует отдельной проверки exists().
+    add_many и remove_many обрабатывают список id и возвращают словарь
+    {id: изменилась ли связь}, None - объекта нет. После изменения
+    сбрасывается кэш токена пользователя с множествами id связей.
+    """
+
+    def get_target_field(self):
+        return next(
+            field for field in self.model._meta.concrete_fields
+            if field.is_relation and field.name != 'user'
+        )
+
+    def insert_links(self, user, target_ids):
+        """id объектов, для которых связь действительно создана.
+
+        INSERT ... SELECT не вставит строку, если объекта нет,
+        ON CONFLICT DO NOTHING - если связь уже есть, в том числе если её
+        только что создал параллельный запрос. RETURNING отдаёт ровно
+        вставленные строки.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        target = self.get_target_field()
+        target_meta = target.related_model._meta
+        created_at = meta.get_field('created_at')
+        placeholders = ', '.join(['%s'] * len(target_ids))
+
+        sql = (
+            f'INSERT INTO {quote(meta.db_table)} '
+            f'({quote(meta.get_field("user").column)}, '
+            f'{quote(target.column)}, {quote(created_at.column)}) '
+            f'SELECT %s, {quote(target_meta.pk.column)}, %s '
+            f'FROM {quote(target_meta.db_table)} '
+            f'WHERE {quote(target_meta.pk.column)} IN ({placeholders}) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(target.column)}'
+        )
+        params = [
+            user.pk,
+            created_at.get_db_prep_value(timezone.now(), connection),
+            *target_ids,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    def delete_links(self, user, target_ids):
+        """id объектов, связь с которыми действительно удалена."""
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        target = self.get_target_field()
+        placeholders = ', '.join(['%s'] * len(target_ids))
+
+        sql = (
+            f'DELETE FROM {quote(meta.db_table)} '
+            f'WHERE {quote(meta.get_field("user").column)} = %s '
+            f'AND {quote(target.column)} IN ({placeholders}) '
+            f'RETURNING {quote(target.column)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *target_ids])
+            return {row[0] for row in cursor.fetchall()}
+
+    def add(self, user, target_id):
+        added = bool(self.insert_links(user, [target_id]))
+        if added:
+            token_cache.invalidate_user(user.pk)
+        return added
+
+    def remove(self, user, target_id):
+        target = self.get_target_field()
+        deleted, _ = self.filter(
+            user=user, **{target.attname: target_id}).delete()
+        if deleted:
+            token_cache.invalidate_user(user.pk)
+        return deleted > 0
+
+    def get_existing(self, target_ids):
+        target = self.get_target_field()
+        return set(
+            target.related_model._default_manager.using(self.db)
+            .filter(pk__in=target_ids).values_list('pk', flat=True)
+        )
+
+    def add_many(self, user, target_ids):
+        # Изменённые id берутся из самой записи, а не из чтения перед
+        # ней: два параллельных запроса не посчитают одну связь дважды
+        added = self.insert_links(user, target_ids)
+        if added:
+            token_cache.invalidate_user(user.pk)
+        existing = self.get_existing(target_ids)
+        return {pk: pk in added if pk in existing else None
+                for pk in target_ids}
+
+    def remove_many(self, user, target_ids):
+        removed = self.delete_links(user, target_ids)
+        if removed:
+            token_cache.invalidate_user(user.pk)
+        existing = self.get_existing(target_ids)
+        return {pk: pk in removed if pk in existing else None
+                for pk in target_ids}
@@ -1,13 +1,69 @@
 from rest_framework import serializers
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
 import base64
+import binascii
+import re
+import tempfile
+
+# Кратно 4, чтобы каждый кусок декодировался независимо
+DECODE_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s+')
+
+
+def decode_base64(data, start):
+    # Строка декодируется кусками во временный файл, без второй полной
+    # копии изображения в памяти
+    if WHITESPACE.search(data, start):
+        # Переносы строк сдвинули бы границы кусков: копия только
+        # для таких строк
+        data, start = WHITESPACE.sub('', data[start:]), 0
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for offset in range(start, len(data), DECODE_CHUNK_SIZE):
+        file.write(base64.b64decode(
+            data[offset:offset + DECODE_CHUNK_SIZE], validate=True))
+    file.seek(0)
+    return file
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            header_end = data.find(';base64,')
+            if header_end == -1:
+                self.fail('invalid_image')
+            ext = data[:header_end].split('/')[-1]
+            try:
+                file = decode_base64(data, header_end + len(';base64,'))
+            except binascii.Error:
+                self.fail('invalid_image')
+            data = File(file, name='temp.' + ext)
 
         return super().to_internal_value(data)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_ITEMS
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+def bulk_results(states, success_status, failure_message):
+    """Результат по каждому id в том виде, что дал бы одиночный запрос."""
+    results = []
+    for pk, changed in states.items():
+        if changed is None:
+            results.append(
+                {'id': pk, 'status': 404, 'detail': 'Страница не найдена.'})
+        elif changed:
+            results.append({'id': pk, 'status': success_status})
+        else:
+            results.append(
+                {'id': pk, 'status': 400, 'detail': failure_message})
+    return results
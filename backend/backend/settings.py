@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,36 +79,79 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE=postgresql переключает проект на PostgreSQL.
+# Под ASGI постоянное соединение не переживает запрос, поэтому там
+# вместо CONN_MAX_AGE нужен пул: DB_POOL=True (драйвер psycopg 3)
+
+if os.getenv('DB_ENGINE', 'sqlite3') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'USER': os.getenv('POSTGRES_USER'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.getenv('DB_POOL', 'False') == 'True':
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            }
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        }
+    }
+
+
+# Cache
+# Для продакшена: CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# и CACHE_LOCATION=redis://redis:6379/0 (или PyMemcacheCache)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'test_db.sqlite3',
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
-# if os.getenv('USE_TEST_BASE', False):
-#     DATABASES = {
-#         'default': {
-#             'ENGINE': 'django.db.backends.sqlite3',
-#             'NAME': BASE_DIR / 'test_db.sqlite3',
-#         }
-#     }
-# else:
-#     DATABASES = {
-#         'default': {
-#             'ENGINE': 'django.db.backends.postgresql',
-#             'NAME': os.getenv('POSTGRES_DB'),
-#             'USER': os.getenv('POSTGRES_USER'),
-#             'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
-#             'HOST': os.getenv('DB_HOST'),
-#             'PORT': os.getenv('DB_PORT')
-#         }
-#     }
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Краткие карточки рецептов автора для подписок: первые
+# AUTHOR_RECIPES_CACHE_SIZE рецептов и их число, ключ с версией автора
+AUTHOR_RECIPES_CACHE_SIZE = int(os.getenv('AUTHOR_RECIPES_CACHE_SIZE', 10))
+AUTHOR_RECIPES_CACHE_TIMEOUT = int(
+    os.getenv('AUTHOR_RECIPES_CACHE_TIMEOUT', 60 * 60))
+
+# Кэш токенов в общем кэше на TOKEN_CACHE_TIMEOUT секунд
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 5 * 60))
+
+# Короткие ссылки /s/<code>/: код -> рецепт в LRU процесса и общем кэше,
+# переходы пишутся в базу пачками
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 4096))
+SHORT_LINK_LOCAL_TIMEOUT = int(os.getenv('SHORT_LINK_LOCAL_TIMEOUT', 60))
+SHORT_LINK_CACHE_TIMEOUT = int(
+    os.getenv('SHORT_LINK_CACHE_TIMEOUT', 24 * 60 * 60))
+SHORT_LINK_HITS_FLUSH_SIZE = int(os.getenv('SHORT_LINK_HITS_FLUSH_SIZE', 100))
+SHORT_LINK_HITS_FLUSH_INTERVAL = int(
+    os.getenv('SHORT_LINK_HITS_FLUSH_INTERVAL', 30))
 
 
 # Password validation
@@ -151,6 +195,27 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/backend_static/media'
 
 
+# Миниатюры загруженных изображений
+IMAGE_THUMBNAIL_FORMAT = os.getenv('IMAGE_THUMBNAIL_FORMAT', 'WEBP')
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv('IMAGE_THUMBNAIL_QUALITY', 80))
+IMAGE_THUMBNAIL_WORKERS = int(os.getenv('IMAGE_THUMBNAIL_WORKERS', 2))
+IMAGE_THUMBNAIL_SIZES = {
+    'recipe': {
+        'card': (480, 480),
+        'detail': (1200, 1200),
+    },
+    'avatar': {
+        'avatar': (160, 160),
+    },
+}
+# Сколько найденных миниатюр помнит процесс, чтобы не проверять
+# хранилище на каждый ответ
+IMAGE_THUMBNAIL_CACHE_SIZE = int(
+    os.getenv('IMAGE_THUMBNAIL_CACHE_SIZE', 10000))
+IMAGE_THUMBNAIL_CACHE_TIMEOUT = int(
+    os.getenv('IMAGE_THUMBNAIL_CACHE_TIMEOUT', 3600))
+
+
 # Rest settigs
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -159,7 +224,14 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.authentication.CachedTokenAuthentication',
+    ],
+
+    # JSON_RENDERER=rest_framework.renderers.JSONRenderer возвращает
+    # стандартный рендерер DRF
+    'DEFAULT_RENDERER_CLASSES': [
+        os.getenv('JSON_RENDERER', 'backend.renderers.ORJSONRenderer'),
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
@@ -187,6 +259,53 @@ DJOSER = {
     'HIDE_USERS': False
 }
 
+# Пакетные операции с избранным, корзиной и подписками
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 100))
+
+# Список покупок
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Автодополнение ингредиентов
+INGREDIENT_INDEX_ENABLED = os.getenv(
+    'INGREDIENT_INDEX_ENABLED', 'True') == 'True'
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Подбор рецептов по имеющимся ингредиентам (?have=): индекс в памяти
+# перестраивается раз в RECIPE_MATCH_INDEX_TTL секунд, в ответе не больше
+# RECIPE_MATCH_LIMIT лучших рецептов
+RECIPE_MATCH_INDEX_TTL = int(os.getenv('RECIPE_MATCH_INDEX_TTL', 300))
+RECIPE_MATCH_LIMIT = int(os.getenv('RECIPE_MATCH_LIMIT', 100))
+
+# Счётчики фасетов кэшируются по набору фильтров, см. recipes/facets.py
+RECIPE_FACETS_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FACETS_CACHE_TIMEOUT', 300))
+
+# Похожие рецепты: команда build_recommendations сохраняет столько
+# соседей на рецепт
+RECOMMENDATIONS_NEIGHBOURS = int(os.getenv('RECOMMENDATIONS_NEIGHBOURS', 20))
+
+# Лента подписок: рецепты авторов с TIMELINE_FANOUT_LIMIT подписчиков и
+# больше читаются при запросе, остальные раскладываются по лентам
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 10000))
+TIMELINE_BATCH_SIZE = int(os.getenv('TIMELINE_BATCH_SIZE', 1000))
+TIMELINE_BACKFILL = int(os.getenv('TIMELINE_BACKFILL', 20))
+
+# Полнотекстовый поиск рецептов (конфигурация PostgreSQL)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
+# Профилирование запросов к базе, см. backend/middleware.py. Выключено
+# по умолчанию, в продакшене включается с малой SAMPLE_RATE
+QUERY_PROFILER = {
+    'ENABLED': os.getenv('QUERY_PROFILER_ENABLED', 'False') == 'True',
+    'SAMPLE_RATE': float(os.getenv('QUERY_PROFILER_SAMPLE_RATE', 1.0)),
+    'STRICT': os.getenv('QUERY_PROFILER_STRICT', 'False') == 'True',
+    'QUERY_BUDGET': int(os.getenv('QUERY_PROFILER_BUDGET', 30)),
+    'DUPLICATE_THRESHOLD': int(
+        os.getenv('QUERY_PROFILER_DUPLICATE_THRESHOLD', 5)),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -6,6 +6,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from recipes.views import short_link_redirect
+
 # Представление для Swagger
 schema_view = get_schema_view(
     openapi.Info(
@@ -23,6 +25,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
     path('api/', include('recipes.urls')),
+    re_path(r'^s/(?P<code>[0-9A-Za-z]+)/?$', short_link_redirect,
+            name='short-link'),
 
     re_path(r'^swagger(?P<format>\.json|\.yaml)$',
             schema_view.without_ui(cache_timeout=0), name='schema-json'),
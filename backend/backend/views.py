@@ -0,0 +1,39 @@
+from rest_framework.response import Response
+
+from backend.middleware import serializer_timing
+
+
+class AsyncReadMixin:
+    """list и retrieve для viewset из adrf на async ORM.
+
+    Записи остаются синхронными: adrf выполняет их через sync_to_async.
+    Сериализаторы получают уже загруженные объекты со всеми prefetch,
+    поэтому сами в базу не обращаются. Вьюсет может переопределить
+    represent и строить ответ без сериализатора, вызывать его стоит
+    через serialize, чтобы время попало в профиль запроса.
+    """
+
+    def represent(self, instance, many=False):
+        return self.get_serializer(instance, many=many).data
+
+    def serialize(self, instance, many=False):
+        with serializer_timing(self.request):
+            return self.represent(instance, many=many)
+
+    async def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = None
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(
+                queryset, request, view=self)
+        rows = page if page is not None else [
+            row async for row in queryset]
+
+        data = self.serialize(rows, many=True)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    async def retrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.serialize(instance))
@@ -1,6 +1,19 @@
 from django.contrib import admin
 
-from .models import Recipe, Ingredient
+from backend.admin import ReadOnlyAdmin
+from .models import (
+    Favorite, Ingredient, Recipe, ShoppingCartItem, ShortLink, SimilarRecipe,
+    TimelineEntry)
 
 admin.site.register(Recipe)
 admin.site.register(Ingredient)
+admin.site.register(Favorite, ReadOnlyAdmin)
+admin.site.register(ShoppingCartItem, ReadOnlyAdmin)
+admin.site.register(SimilarRecipe)
+admin.site.register(TimelineEntry)
+
+
+@admin.register(ShortLink)
+class ShortLinkAdmin(admin.ModelAdmin):
+    list_display = ('code', 'recipe', 'hits')
+    readonly_fields = ('code', 'recipe', 'hits')
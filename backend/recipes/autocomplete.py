@@ -0,0 +1,66 @@
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+
+class IngredientPrefixIndex:
+    """Отсортированный в памяти список ингредиентов для поиска по префиксу."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._rows = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._rows = None
+
+    def _build(self):
+        rows = sorted(
+            (name.casefold(), pk, name, unit)
+            for pk, name, unit in Ingredient.objects.order_by().values_list(
+                'id', 'name', 'measurement_unit')
+        )
+        self._keys = [row[0] for row in rows]
+        self._rows = [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for _, pk, name, unit in rows
+        ]
+        self._built_at = time.monotonic()
+
+    def is_fresh(self):
+        return self._keys is not None and (
+            time.monotonic() - self._built_at <= settings.INGREDIENT_INDEX_TTL)
+
+    def search(self, prefix):
+        with self._lock:
+            if not self.is_fresh():
+                self._build()
+            keys, rows = self._keys, self._rows
+        return self._match(keys, rows, prefix)
+
+    async def asearch(self, prefix):
+        # Запрос к базе нужен только для перестройки индекса
+        with self._lock:
+            fresh = self.is_fresh()
+            keys, rows = self._keys, self._rows
+        if not fresh:
+            return await sync_to_async(self.search)(prefix)
+        return self._match(keys, rows, prefix)
+
+    @staticmethod
+    def _match(keys, rows, prefix):
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', start)
+        return rows[start:end]
+
+
+ingredient_index = IngredientPrefixIndex()
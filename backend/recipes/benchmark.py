@@ -0,0 +1,217 @@
+import base64
+import io
+import random
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCartItem)
+from recipes.shopping_list import rebuild_shopping_lists
+from users.models import Subscription
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+@dataclass
+class Scale:
+    users: int = 50
+    recipes: int = 500
+    ingredients: int = 1000
+    ingredients_per_recipe: int = 8
+    favorites: int = 20
+    carts: int = 10
+    subscriptions: int = 10
+
+
+def make_image_payload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 80, 40)).save(buffer, format='PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+def seed(scale, seed=0):
+    """Заполняет базу синтетическими данными пакетными вставками."""
+    rng = random.Random(seed)
+    password = make_password('benchmark')
+
+    users = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com',
+             first_name='Bench', last_name=str(i), password=password)
+        for i in range(scale.users)
+    ], batch_size=BATCH_SIZE)
+    ingredients = Ingredient.objects.bulk_create([
+        Ingredient(name=f'ингредиент {i:06d}', measurement_unit='г')
+        for i in range(scale.ingredients)
+    ], batch_size=BATCH_SIZE)
+    per_recipe = min(scale.ingredients_per_recipe, len(ingredients))
+    recipes = Recipe.objects.bulk_create([
+        Recipe(author=users[i % len(users)], name=f'Рецепт {i:06d}',
+               image='recipes/images/benchmark.png',
+               text='Синтетический рецепт для замеров',
+               cooking_time=rng.randint(5, 120),
+               ingredients_count=per_recipe)
+        for i in range(scale.recipes)
+    ], batch_size=BATCH_SIZE)
+
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                         amount=rng.randint(1, 500))
+        for recipe in recipes
+        for ingredient in rng.sample(ingredients, per_recipe)
+    ], batch_size=BATCH_SIZE)
+
+    def links(model, target, count, choices, counter):
+        rows = model.objects.bulk_create([
+            model(**{'user': user, target: item})
+            for user in users
+            for item in rng.sample(choices, min(count, len(choices)))
+            if item != user
+        ], batch_size=BATCH_SIZE)
+        if counter:
+            totals = Counter(getattr(row, f'{target}_id') for row in rows)
+            items = [item for item in choices if item.pk in totals]
+            for item in items:
+                setattr(item, counter, totals[item.pk])
+            type(choices[0]).objects.bulk_update(
+                items, [counter], batch_size=BATCH_SIZE)
+
+    links(Favorite, 'recipe', scale.favorites, recipes, 'favorites_count')
+    links(ShoppingCartItem, 'recipe', scale.carts, recipes, None)
+    links(Subscription, 'author', scale.subscriptions, users,
+          'subscribers_count')
+    rebuild_shopping_lists()
+    return users[0]
+
+
+def read_streaming(response):
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def read():
+        return b''.join(
+            [chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+class Benchmark:
+    def __init__(self, user, iterations):
+        self.iterations = iterations
+        self.user = user
+        self.token = Token.objects.get_or_create(user=user)[0].key
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.anonymous = Client()
+        self.recipe_id = user.recipes.values_list('id', flat=True).first()
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('id', flat=True)[:3])
+        self.image = make_image_payload()
+
+    def recipe_payload(self, name):
+        return {
+            'name': name,
+            'text': 'Замер создания рецепта',
+            'cooking_time': 15,
+            'image': self.image,
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in self.ingredient_ids],
+        }
+
+    def scenarios(self):
+        return {
+            'recipe_list': lambda i: self.client.get(
+                '/api/recipes/', {'limit': 10, 'offset': i % 5 * 10}),
+            'recipe_list_anonymous': lambda i: self.anonymous.get(
+                '/api/recipes/', {'limit': 10}),
+            'recipe_detail': lambda i: self.client.get(
+                f'/api/recipes/{self.recipe_id}/'),
+            'ingredient_search': lambda i: self.client.get(
+                '/api/ingredients/', {'name': f'ингредиент {i % 10}'}),
+            'shopping_list': lambda i: self.client.get(
+                '/api/recipes/download_shopping_cart/'),
+            'subscriptions': lambda i: self.client.get(
+                '/api/users/subscriptions/',
+                {'limit': 6, 'recipes_limit': 3}),
+            'recipe_create': lambda i: self.client.post(
+                '/api/recipes/', self.recipe_payload(f'Замер {i}'),
+                content_type='application/json'),
+            'recipe_update': lambda i: self.client.patch(
+                f'/api/recipes/{self.recipe_id}/',
+                {'name': f'Обновлённый {i}', 'ingredients': [
+                    {'id': pk, 'amount': 10 + i}
+                    for pk in self.ingredient_ids]},
+                content_type='application/json'),
+        }
+
+    def measure(self, request):
+        cache.clear()
+        timings = []
+        queries = []
+        for i in range(self.iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request(i)
+                if response.streaming:
+                    read_streaming(response)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f'Ответ {response.status_code}: {response.content[:200]}')
+            queries.append(len(context.captured_queries))
+        return summarize(timings, queries)
+
+    def run(self, names=None):
+        scenarios = self.scenarios()
+        return {
+            name: self.measure(scenarios[name])
+            for name in (names or scenarios)
+        }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(timings, queries):
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p90_ms': round(percentile(timings, 0.9), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Возвращает список регрессий относительно прошлого прогона."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        limit = previous['p50_ms'] * (1 + threshold)
+        if current['p50_ms'] > limit:
+            regressions.append(
+                f'{name}: p50 {current["p50_ms"]} мс > {limit:.3f} мс')
+        if current['queries'] > previous['queries']:
+            regressions.append(
+                f'{name}: запросов {current["queries"]} > '
+                f'{previous["queries"]}')
+    return regressions
@@ -0,0 +1,89 @@
+"""Счётчики фасетов для фильтров списка рецептов.
+
+Все счётчики - условные COUNT в одном агрегирующем запросе по уже
+отфильтрованным рецептам: сколько из них останется, если добавить
+значение фасета к фильтрам. Ответ кэшируется по набору фильтров
+до следующего изменения рецептов.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Q
+
+from backend.cache import get_versions
+from recipes.models import RecipeIngredient
+
+# Интервалы времени приготовления: (cooking_time_min, cooking_time_max)
+COOKING_TIME = ((None, 15), (16, 30), (31, 60), (61, None))
+# Значения max_ingredients
+MAX_INGREDIENTS = (3, 5, 10, 15)
+# Сколько ингредиентов можно запросить в ?facet_ingredients=
+FACET_INGREDIENTS_LIMIT = 50
+
+# Параметры, которые не меняют набор рецептов
+IGNORED_PARAMS = {'count', 'cursor', 'limit', 'offset', 'ordering', 'page'}
+
+
+def cooking_time_filter(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(cooking_time__gte=low)
+    if high is not None:
+        condition &= Q(cooking_time__lte=high)
+    return condition
+
+
+def count_facets(queryset, ingredient_ids=()):
+    ingredient_ids = list(dict.fromkeys(ingredient_ids))[
+        :FACET_INGREDIENTS_LIMIT]
+    aggregates = {'count': Count('pk')}
+    for position, (low, high) in enumerate(COOKING_TIME):
+        aggregates[f'cooking_time_{position}'] = Count(
+            'pk', filter=cooking_time_filter(low, high))
+    for limit in MAX_INGREDIENTS:
+        aggregates[f'max_ingredients_{limit}'] = Count(
+            'pk', filter=Q(ingredients_count__lte=limit))
+    for ingredient_id in ingredient_ids:
+        aggregates[f'ingredient_{ingredient_id}'] = Count(
+            'pk', filter=Exists(RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk'), ingredient=ingredient_id)))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    return {
+        'count': counts['count'],
+        'cooking_time': [
+            {'min': low, 'max': high,
+             'count': counts[f'cooking_time_{position}']}
+            for position, (low, high) in enumerate(COOKING_TIME)
+        ],
+        'max_ingredients': [
+            {'value': limit, 'count': counts[f'max_ingredients_{limit}']}
+            for limit in MAX_INGREDIENTS
+        ],
+        'ingredients': [
+            {'id': pk, 'count': counts[f'ingredient_{pk}']}
+            for pk in ingredient_ids
+        ],
+    }
+
+
+def cache_key(params):
+    # Порядок параметров в адресе на набор рецептов не влияет
+    items = sorted(
+        (name, value) for name, values in params.lists()
+        if name not in IGNORED_PARAMS for value in values)
+    versions = get_versions('recipes')
+    return 'facets:' + hashlib.md5(
+        f'{items}:{versions}'.encode()).hexdigest()
+
+
+def get_facets(queryset, params, ingredient_ids=(), cached=True):
+    if not cached:
+        return count_facets(queryset, ingredient_ids)
+    key = cache_key(params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = count_facets(queryset, ingredient_ids)
+        cache.set(key, facets, settings.RECIPE_FACETS_CACHE_TIMEOUT)
+    return facets
@@ -0,0 +1,62 @@
+from django.db.models import Count
+from django_filters.rest_framework import (
+    BaseInFilter, BooleanFilter, FilterSet, NumberFilter)
+
+from recipes.models import Recipe, RecipeIngredient
+
+
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
+
+
+def with_ingredients(queryset, ingredient_ids):
+    # Рецепты, в которых есть все ингредиенты: один подзапрос по индексу
+    # recipe_ingredient_lookup_idx вместо JOIN на каждый ингредиент
+    ingredient_ids = set(ingredient_ids)
+    return queryset.filter(pk__in=RecipeIngredient.objects.filter(
+        ingredient__in=ingredient_ids
+    ).order_by().values('recipe').annotate(
+        found=Count('ingredient')).filter(
+        found=len(ingredient_ids)).values('recipe'))
+
+
+def without_ingredients(queryset, ingredient_ids):
+    return queryset.exclude(pk__in=RecipeIngredient.objects.filter(
+        ingredient__in=ingredient_ids).values('recipe'))
+
+
+class RecipeFilter(FilterSet):
+    """Фильтры списка рецептов.
+
+    ingredients и exclude_ingredients - id через запятую: рецепт должен
+    содержать все ingredients и ни одного из exclude_ingredients.
+    """
+
+    author = NumberFilter(field_name='author')
+    is_favorited = BooleanFilter(method='filter_user_flag')
+    is_in_shopping_cart = BooleanFilter(method='filter_user_flag')
+    cooking_time_min = NumberFilter(
+        field_name='cooking_time', lookup_expr='gte')
+    cooking_time_max = NumberFilter(
+        field_name='cooking_time', lookup_expr='lte')
+    max_ingredients = NumberFilter(
+        field_name='ingredients_count', lookup_expr='lte')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
+
+    class Meta:
+        model = Recipe
+        fields = []
+
+    def filter_user_flag(self, queryset, name, value):
+        # Флаги посчитаны в RecipeQuerySet.with_user_flags, у анонимного
+        # пользователя фильтр не применяется
+        if value and self.request.user.is_authenticated:
+            return queryset.filter(**{name: True})
+        return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        return with_ingredients(queryset, [int(pk) for pk in value])
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        return without_ingredients(queryset, [int(pk) for pk in value])
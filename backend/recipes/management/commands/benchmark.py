@@ -0,0 +1,73 @@
+import json
+import tempfile
+from dataclasses import asdict, fields
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment)
+
+from recipes.benchmark import Benchmark, Scale, compare, seed
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержки и число запросов горячих эндпоинтов API '
+            'на синтетических данных во временной тестовой базе')
+
+    def add_arguments(self, parser):
+        for field in fields(Scale):
+            parser.add_argument(
+                f'--{field.name.replace("_", "-")}',
+                type=int, default=field.default)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--scenario', action='append', dest='scenarios')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=Path)
+        parser.add_argument('--baseline', type=Path)
+        parser.add_argument('--threshold', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        scale = Scale(**{
+            field.name: options[field.name] for field in fields(Scale)})
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media, \
+                    override_settings(MEDIA_ROOT=media):
+                user = seed(scale, options['seed'])
+                results = Benchmark(user, options['iterations']).run(
+                    options['scenarios'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:24} p50={result["p50_ms"]:>9.2f} мс  '
+                f'p90={result["p90_ms"]:>9.2f} мс  '
+                f'p99={result["p99_ms"]:>9.2f} мс  '
+                f'запросов={result["queries"]}'
+            )
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'scale': asdict(scale),
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if options['output']:
+            options['output'].write_text(json.dumps(report, indent=2))
+
+        if options['baseline']:
+            baseline = json.loads(options['baseline'].read_text())
+            regressions = compare(
+                results, baseline['results'], options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.recommendations import METRICS, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие рецепты по избранному и корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbours', type=int,
+            default=settings.RECOMMENDATIONS_NEIGHBOURS,
+            help='Соседей на рецепт')
+        parser.add_argument(
+            '--metric', choices=METRICS, default='cosine',
+            help='Мера сходства')
+        parser.add_argument(
+            '--min-score', type=float, default=0.0,
+            help='Соседи с меньшим сходством не сохраняются')
+
+    def handle(self, *args, **options):
+        count = build_recommendations(
+            options['neighbours'], options['metric'], options['min_score'])
+        self.stdout.write(self.style.SUCCESS(f'Пар похожих рецептов: {count}'))
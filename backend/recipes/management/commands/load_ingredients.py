@@ -0,0 +1,94 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if row:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    # Массив объектов разбирается по одному элементу, без загрузки
+    # всего файла в память
+    decoder = json.JSONDecoder()
+    buffer = ''
+    with open(path, encoding='utf-8') as file:
+        while True:
+            chunk = file.read(READ_CHUNK_SIZE)
+            buffer = (buffer + chunk).lstrip('[, \r\n\t')
+            while buffer and not buffer.startswith(']'):
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break
+                yield item['name'], item['measurement_unit']
+                buffer = buffer[end:].lstrip(', \r\n\t')
+            if not chunk:
+                break
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из data/ingredients.csv или .json'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=Path(settings.BASE_DIR) / 'data' / 'ingredients.csv')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        reader = READERS.get(path.suffix)
+        if reader is None:
+            raise CommandError(f'Неподдерживаемый формат файла: {path}')
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+
+        rows = reader(path)
+        before = Ingredient.objects.count()
+        started = time.monotonic()
+        total = 0
+
+        while batch := list(islice(rows, options['batch_size'])):
+            # Уже существующие пары (name, measurement_unit) пропускаются
+            # уникальным ограничением, поэтому повторный запуск безопасен
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in batch],
+                ignore_conflicts=True
+            )
+            total += len(batch)
+            self.stdout.write(
+                f'Обработано строк: {total} '
+                f'({total / self.elapsed(started):.0f} строк/с)'
+            )
+
+        ingredient_index.invalidate()
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {total} строк за {self.elapsed(started):.2f} с, '
+            f'добавлено новых ингредиентов: {created}'
+        ))
+
+    @staticmethod
+    def elapsed(started):
+        return max(time.monotonic() - started, 1e-6)
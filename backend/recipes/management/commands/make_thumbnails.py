@@ -0,0 +1,37 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from backend.images import make_thumbnails
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Создаёт недостающие миниатюры изображений рецептов '
+            'и аватаров')
+
+    def handle(self, *args, **options):
+        sources = [
+            (Recipe.objects.exclude(image='').values_list(
+                'image', flat=True), 'recipe'),
+            (User.objects.exclude(avatar='').values_list(
+                'avatar', flat=True), 'avatar'),
+        ]
+        done = failed = 0
+        for names, kind in sources:
+            for name in names.iterator():
+                try:
+                    make_thumbnails(name, kind)
+                except Exception:
+                    logger.exception(
+                        'Не удалось создать миниатюры для %s', name)
+                    failed += 1
+                else:
+                    done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено изображений: {done}, с ошибками: {failed}'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import (
+    expected_shopping_lists, rebuild_shopping_lists)
+
+
+def find_mismatches():
+    expected = expected_shopping_lists()
+    actual = dict(
+        ((user_id, ingredient_id), total)
+        for user_id, ingredient_id, total in ShoppingListItem.objects
+        .values_list('user_id', 'ingredient_id', 'total_amount')
+    )
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает списки покупок из корзин и сверяет результат'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить списки с корзинами, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            with transaction.atomic():
+                rebuild_shopping_lists()
+            self.stdout.write(self.style.SUCCESS(
+                'Строк в списках покупок: '
+                f'{ShoppingListItem.objects.count()}'))
+
+        mismatches = find_mismatches()
+        for (user_id, ingredient_id), expected, actual in mismatches[:20]:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'ожидалось {expected}, в списке {actual}')
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
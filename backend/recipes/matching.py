@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from recipes.models import RecipeIngredient
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class RecipeMatchIndex:
+    """Инвертированный индекс ингредиент -> рецепты для ?have=.
+
+    Рецепты занимают позиции в массивах recipe_ids и sizes (число
+    ингредиентов), для каждого ингредиента хранится массив позиций
+    рецептов. Покрытие для набора ингредиентов - один np.bincount по
+    склеенным массивам, недостающие - sizes минус покрытие.
+
+    Изменённые рецепты отмечаются сигналами и дочитываются одним
+    запросом перед следующим поиском. Изменения из других процессов
+    подхватывает полная перестройка раз в RECIPE_MATCH_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._stale = set()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def mark_stale(self, recipe_ids):
+        with self._lock:
+            self._stale.update(recipe_ids)
+
+    def _build(self):
+        pairs = np.array(
+            list(RecipeIngredient.objects.order_by().values_list(
+                'recipe_id', 'ingredient_id')),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        recipe_ids, positions = np.unique(pairs[:, 0], return_inverse=True)
+        self._recipe_ids = recipe_ids
+        self._positions = {
+            int(pk): position for position, pk in enumerate(recipe_ids)}
+        self._sizes = np.bincount(positions, minlength=len(recipe_ids))
+
+        ingredients = pairs[:, 1]
+        order = np.lexsort((positions, ingredients))
+        self._postings = self._split(ingredients[order], positions[order])
+        order = np.lexsort((ingredients, positions))
+        self._recipe_ingredients = self._split(
+            positions[order], ingredients[order])
+
+        self._stale.clear()
+        self._built_at = time.monotonic()
+
+    @staticmethod
+    def _split(keys, values):
+        if not len(keys):
+            return {}
+        unique, starts = np.unique(keys, return_index=True)
+        return {
+            int(key): chunk
+            for key, chunk in zip(unique, np.split(values, starts[1:]))
+        }
+
+    def _apply_stale(self):
+        recipe_ids, self._stale = self._stale, set()
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by().values_list('recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+
+        added = [pk for pk in ingredients if pk not in self._positions]
+        if added:
+            start = len(self._recipe_ids)
+            self._recipe_ids = np.concatenate(
+                [self._recipe_ids, np.array(added, dtype=np.int64)])
+            self._sizes = np.concatenate(
+                [self._sizes, np.zeros(len(added), dtype=np.int64)])
+            for offset, pk in enumerate(added):
+                self._positions[pk] = start + offset
+
+        for recipe_id in recipe_ids:
+            position = self._positions.get(recipe_id)
+            if position is None:
+                continue
+            # Удалённый рецепт остаётся с нулевым составом и не находится
+            for ingredient_id in self._recipe_ingredients.pop(
+                    position, EMPTY):
+                posting = self._postings[int(ingredient_id)]
+                self._postings[int(ingredient_id)] = posting[
+                    posting != position]
+            new = np.array(ingredients.get(recipe_id, []), dtype=np.int64)
+            for ingredient_id in new:
+                self._postings[int(ingredient_id)] = np.append(
+                    self._postings.get(int(ingredient_id), EMPTY), position)
+            if len(new):
+                self._recipe_ingredients[position] = new
+            self._sizes[position] = len(new)
+
+    def is_fresh(self):
+        return self._built_at is not None and not self._stale and (
+            time.monotonic() - self._built_at
+            <= settings.RECIPE_MATCH_INDEX_TTL)
+
+    def _refresh(self):
+        if self._built_at is None or (
+                time.monotonic() - self._built_at
+                > settings.RECIPE_MATCH_INDEX_TTL):
+            self._build()
+        elif self._stale:
+            self._apply_stale()
+
+    def match(self, ingredient_ids, max_missing=None, limit=None):
+        """[(recipe_id, совпало, не хватает)] от лучших к худшим."""
+        with self._lock:
+            self._refresh()
+            return self._match(ingredient_ids, max_missing, limit)
+
+    async def amatch(self, ingredient_ids, max_missing=None, limit=None):
+        # Запрос к базе нужен только для перестройки или дочитывания
+        with self._lock:
+            if self.is_fresh():
+                return self._match(ingredient_ids, max_missing, limit)
+        return await sync_to_async(self.match)(
+            ingredient_ids, max_missing, limit)
+
+    def _match(self, ingredient_ids, max_missing, limit):
+        postings = [
+            self._postings[pk] for pk in set(ingredient_ids)
+            if pk in self._postings
+        ]
+        if not postings:
+            return []
+        covered = np.bincount(
+            np.concatenate(postings), minlength=len(self._recipe_ids))
+        missing = self._sizes - covered
+        selected = covered > 0
+        if max_missing is not None:
+            selected &= missing <= max_missing
+        candidates = np.flatnonzero(selected)
+
+        # Меньше недостающих, затем больше совпавших, затем по id
+        order = np.lexsort((
+            self._recipe_ids[candidates],
+            -covered[candidates],
+            missing[candidates],
+        ))
+        if limit is not None:
+            order = order[:limit]
+        candidates = candidates[order]
+        return [
+            (int(pk), int(count), int(lack))
+            for pk, count, lack in zip(
+                self._recipe_ids[candidates],
+                covered[candidates],
+                missing[candidates])
+        ]
+
+
+def match_recipes(queryset, matches):
+    """Рецепты из результата match в его порядке, ранг в match_rank."""
+    if not matches:
+        return queryset.none()
+    rank = Case(
+        *(When(pk=pk, then=Value(position))
+          for position, (pk, _, _) in enumerate(matches)),
+        output_field=IntegerField()
+    )
+    return queryset.filter(pk__in=[pk for pk, _, _ in matches]).annotate(
+        match_rank=rank).order_by('match_rank')
+
+
+recipe_match_index = RecipeMatchIndex()
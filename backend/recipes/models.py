@@ -1,7 +1,15 @@
+from django.apps import apps
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (
+    Count, Exists, F, FloatField, OuterRef, Prefetch, Q, Subquery, Sum,
+    Value)
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
+from backend.querysets import RelationQuerySet
+
 User = get_user_model()
 
 
@@ -14,11 +22,85 @@ class Ingredient(models.Model):
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['name', 'id'], name='ingredient_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            Prefetch(
+                'ingredient_amounts',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        # Флаги для списка рецептов считаются подзапросами в одном SELECT,
+        # а не отдельным запросом на каждую строку
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        Subscription = apps.get_model('users', 'Subscription')
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCartItem.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def similar_to(self, recipe_id):
+        # Соседи рецепта по индексу similar_recipe_score_idx
+        return self.filter(similar_to__recipe=recipe_id).annotate(
+            similarity=F('similar_to__score')
+        ).order_by('-similarity', 'id')
+
+    def recommended(self, seed_ids):
+        # Сумма сходства с рецептами пользователя, сами они исключаются
+        scores = SimilarRecipe.objects.filter(
+            recipe__in=seed_ids, similar=OuterRef('pk')
+        ).order_by().values('similar').annotate(
+            total=Sum('score')).values('total')
+        return self.filter(
+            pk__in=SimilarRecipe.objects.filter(
+                recipe__in=seed_ids).values('similar')
+        ).exclude(pk__in=seed_ids).annotate(
+            recommendation_score=Subquery(scores, output_field=FloatField())
+        ).order_by('-recommendation_score', 'id')
+
+    def update_ingredients_count(self):
+        # У рецепта без строк ингредиентов подзапрос вернул бы NULL
+        return self.update(ingredients_count=Coalesce(Subquery(
+            RecipeIngredient.objects.filter(recipe=OuterRef('pk')).order_by(
+            ).values('recipe').annotate(total=Count('id')).values('total')
+        ), 0))
+
+    def timeline(self, user, fanout_limit):
+        # Рецепты обычных авторов уже разложены в TimelineEntry,
+        # рецепты популярных (fanout_limit подписчиков и больше)
+        # читаются напрямую
+        entries = TimelineEntry.objects.filter(user=user).values('recipe')
+        popular = user.subscriptions.filter(
+            subscribers_count__gte=fanout_limit).values('id')
+        return self.filter(
+            Q(pk__in=entries) | Q(author__in=popular)).order_by('-id')
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -44,11 +126,40 @@ class Recipe(models.Model):
         validators=[MinValueValidator(1)],
         blank=False
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='в избранном', default=0, editable=False)
+    # Для фильтра max_ingredients без подсчёта по RecipeIngredient
+    ingredients_count = models.PositiveIntegerField(
+        verbose_name='число ингредиентов', default=0, editable=False)
+    # Заполняется только на PostgreSQL, см. recipes/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ['name']
+        indexes = [
+            # Ключи постраничного обхода по курсору
+            models.Index(fields=['name', 'id'], name='recipe_name_id_idx'),
+            models.Index(
+                fields=['author', 'name', 'id'],
+                name='recipe_author_name_id_idx'
+            ),
+            # Сортировка по популярности
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popularity_idx'
+            ),
+            # Фильтры по времени приготовления и числу ингредиентов
+            models.Index(
+                fields=['cooking_time'], name='recipe_cooking_time_idx'),
+            models.Index(
+                fields=['ingredients_count'],
+                name='recipe_ingredients_count_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -67,6 +178,13 @@ class RecipeIngredient(models.Model):
                 name='unique_ingredient_in_recipe'
             )
         ]
+        indexes = [
+            # Рецепты с ингредиентом: уникальный индекс начинается с recipe
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='recipe_ingredient_lookup_idx'
+            ),
+        ]
         ordering = ['ingredient__name']
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
@@ -75,3 +193,175 @@ class RecipeIngredient(models.Model):
         name = self.ingredient.name
         unit = self.ingredient.measurement_unit
         return f"{name} - {self.amount}{unit}"
+
+
+class UserRecipeRelation(models.Model):
+    user = models.ForeignKey(
+        User, verbose_name='пользователь', on_delete=models.CASCADE,
+        related_name='%(class)s_items')
+    recipe = models.ForeignKey(
+        Recipe, verbose_name='рецепт', on_delete=models.CASCADE,
+        related_name='%(class)s_items')
+    created_at = models.DateTimeField('добавлен', auto_now_add=True)
+
+    objects = RelationQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_%(class)s'
+            )
+        ]
+        indexes = [
+            # Список пользователя от новых к старым и выборка по рецепту
+            models.Index(
+                fields=['user', 'created_at'],
+                name='%(class)s_user_time_idx'
+            ),
+            models.Index(fields=['recipe'], name='%(class)s_recipe_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class Favorite(UserRecipeRelation):
+    class Meta(UserRecipeRelation.Meta):
+        verbose_name = 'Избранный рецепт'
+        verbose_name_plural = 'Избранные рецепты'
+
+
+class ShoppingCartItem(UserRecipeRelation):
+    class Meta(UserRecipeRelation.Meta):
+        verbose_name = 'Рецепт в списке покупок'
+        verbose_name_plural = 'Рецепты в списке покупок'
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя.
+
+    Поддерживается при изменении корзины и состава рецептов
+    (см. recipes/shopping_list.py), пересобирается командой
+    rebuild_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        User, verbose_name='пользователь', on_delete=models.CASCADE,
+        related_name='shopping_list_items')
+    ingredient = models.ForeignKey(
+        Ingredient, verbose_name='ингредиент', on_delete=models.CASCADE,
+        related_name='shopping_list_items')
+    total_amount = models.IntegerField('количество')
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        ordering = ['ingredient__name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount}'
+
+
+class ShortLink(models.Model):
+    """Короткая ссылка /s/<code>/ на страницу рецепта.
+
+    Код выдаёт recipes.short_links.make_code, переходы копятся в памяти
+    и записываются в hits пачками.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe, verbose_name='рецепт', on_delete=models.CASCADE,
+        related_name='short_link')
+    code = models.CharField('код', max_length=16, unique=True)
+    hits = models.PositiveBigIntegerField(
+        'переходы', default=0, editable=False)
+    created_at = models.DateTimeField('создана', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Короткая ссылка'
+        verbose_name_plural = 'Короткие ссылки'
+
+    def __str__(self):
+        return self.code
+
+
+class SimilarRecipe(models.Model):
+    """Сосед рецепта в item-item модели рекомендаций.
+
+    Таблицу целиком пересобирает команда build_recommendations по
+    избранному и корзинам пользователей.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe, verbose_name='рецепт', on_delete=models.CASCADE,
+        related_name='similar_recipes')
+    similar = models.ForeignKey(
+        Recipe, verbose_name='похожий рецепт', on_delete=models.CASCADE,
+        related_name='similar_to')
+    score = models.FloatField('сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя (fan-out on write).
+
+    Записи добавляются при публикации рецепта и подписке, удаляются при
+    отписке, см. recipes/timeline.py.
+    """
+
+    user = models.ForeignKey(
+        User, verbose_name='читатель', on_delete=models.CASCADE,
+        related_name='timeline_entries')
+    recipe = models.ForeignKey(
+        Recipe, verbose_name='рецепт', on_delete=models.CASCADE,
+        related_name='timeline_entries')
+    author = models.ForeignKey(
+        User, verbose_name='автор', on_delete=models.CASCADE,
+        related_name='+')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            # Лента от новых к старым и очистка при отписке
+            models.Index(
+                fields=['user', '-recipe'], name='timeline_user_recipe_idx'),
+            models.Index(
+                fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
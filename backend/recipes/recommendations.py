@@ -0,0 +1,78 @@
+"""Item-item модель рекомендаций по избранному и корзинам.
+
+Матрица пользователь x рецепт бинарная: 1, если рецепт в избранном или
+в корзине. Совместные появления рецептов - строки X^T X, которые
+считаются блоками, чтобы не держать в памяти всю матрицу рецепт x рецепт.
+"""
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from recipes.models import Favorite, ShoppingCartItem, SimilarRecipe
+
+METRICS = ('cosine', 'jaccard')
+
+
+def interaction_matrix():
+    pairs = np.array(
+        list(Favorite.objects.order_by().values_list('user_id', 'recipe_id'))
+        + list(ShoppingCartItem.objects.order_by().values_list(
+            'user_id', 'recipe_id')),
+        dtype=np.int64
+    ).reshape(-1, 2)
+    _, users = np.unique(pairs[:, 0], return_inverse=True)
+    recipe_ids, recipes = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (users, recipes)),
+        shape=(users.max(initial=-1) + 1, len(recipe_ids))
+    )
+    # Рецепт и в избранном, и в корзине - всё равно одно появление
+    matrix.data[:] = 1
+    return matrix, recipe_ids
+
+
+def top_neighbours(matrix, neighbours, metric='cosine', min_score=0.0,
+                   batch_size=1000):
+    """Строки (i, j, score): до neighbours соседей на рецепт."""
+    by_recipe = matrix.T.tocsr()
+    counts = np.diff(by_recipe.indptr).astype(np.float64)
+    for start in range(0, by_recipe.shape[0], batch_size):
+        block = (by_recipe[start:start + batch_size] @ matrix).tocsr()
+        for row in range(block.shape[0]):
+            recipe = start + row
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            columns = block.indices[begin:end]
+            together = block.data[begin:end].astype(np.float64)
+            keep = columns != recipe
+            columns, together = columns[keep], together[keep]
+            if metric == 'cosine':
+                scores = together / np.sqrt(counts[recipe] * counts[columns])
+            else:
+                scores = together / (
+                    counts[recipe] + counts[columns] - together)
+            keep = scores >= min_score
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > neighbours:
+                best = np.argpartition(-scores, neighbours - 1)[:neighbours]
+                columns, scores = columns[best], scores[best]
+            for column, score in zip(columns, scores):
+                yield recipe, int(column), float(score)
+
+
+def build_recommendations(neighbours, metric='cosine', min_score=0.0,
+                          batch_size=1000):
+    matrix, recipe_ids = interaction_matrix()
+    rows = [
+        SimilarRecipe(
+            recipe_id=int(recipe_ids[recipe]),
+            similar_id=int(recipe_ids[column]),
+            score=score
+        )
+        for recipe, column, score in top_neighbours(
+            matrix, neighbours, metric, min_score, batch_size)
+    ]
+    # Запросы видят либо старую модель целиком, либо новую
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        SimilarRecipe.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,55 @@
+"""Быстрый путь сериализации для чтения.
+
+Функции строят те же словари, что RecipeSerializer и ShortRecipeSerializer,
+но без полей DRF. Объекты должны прийти из with_related().with_user_flags(),
+то есть со всеми prefetch и аннотациями. Совпадение ответов проверяется
+контрактными тестами.
+"""
+from users.representations import user_row
+
+
+def ingredient_rows(recipe):
+    return [
+        {
+            'id': item.ingredient.id,
+            'name': item.ingredient.name,
+            'measurement_unit': item.ingredient.measurement_unit,
+            'amount': item.amount,
+        }
+        for item in recipe.ingredient_amounts.all()
+    ]
+
+
+def recipe_row(recipe, media):
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'author': user_row(
+            recipe.author, media, recipe.author_is_subscribed),
+        'image': media.file_url(recipe.image),
+        'thumbnails': media.thumbnails(recipe.image, 'recipe'),
+        'text': recipe.text,
+        'ingredients': ingredient_rows(recipe),
+        'cooking_time': recipe.cooking_time,
+        'is_favorited': recipe.is_favorited,
+        'is_in_shopping_cart': recipe.is_in_shopping_cart,
+    }
+
+
+def short_recipe_row(recipe, media):
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'image': media.file_url(recipe.image),
+        'cooking_time': recipe.cooking_time,
+    }
+
+
+def summary_row(summary, media):
+    # Карточка из recipes.summaries: image там - имя файла
+    return {
+        'id': summary['id'],
+        'name': summary['name'],
+        'image': media.url(summary['image']) if summary['image'] else None,
+        'cooking_time': summary['cooking_time'],
+    }
@@ -0,0 +1,140 @@
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector)
+from django.db import connection, transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeIngredient
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def create_fts_table(cursor):
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+        'USING fts5(name, text, ingredients)'
+    )
+
+
+def fts_table_exists(cursor):
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+        [FTS_TABLE]
+    )
+    return cursor.fetchone() is not None
+
+
+def get_ingredient_names(recipe_ids):
+    names = {pk: [] for pk in recipe_ids}
+    for recipe_id, name in RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by().values_list('recipe_id', 'ingredient__name'):
+        names[recipe_id].append(name)
+    return {pk: ' '.join(items) for pk, items in names.items()}
+
+
+def update_search_index(recipe_ids):
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids).values_list(
+        'id', 'name', 'text'))
+    ingredients = get_ingredient_names([pk for pk, _, _ in recipes])
+
+    if connection.vendor == 'postgresql':
+        if not recipes:
+            return
+        config = settings.SEARCH_CONFIG
+        # Один UPDATE на пачку: состав каждого рецепта подставляет CASE
+        names = Case(
+            *(When(pk=pk, then=Value(ingredients[pk]))
+              for pk, _, _ in recipes),
+            output_field=TextField()
+        )
+        Recipe.objects.filter(pk__in=ingredients).update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector(names, weight='B', config=config)
+            + SearchVector('text', weight='C', config=config)
+        ))
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in recipe_ids]
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+                'VALUES (%s, %s, %s, %s)',
+                [(pk, name, text, ingredients[pk])
+                 for pk, name, text in recipes]
+            )
+
+
+class PendingRecipes(threading.local):
+    """Рецепты, ждущие обновления индекса, по алиасам соединений потока."""
+
+    def __init__(self):
+        self.recipe_ids = {}
+
+
+pending = PendingRecipes()
+
+
+def flush_search_index_update(using):
+    recipe_ids = pending.recipe_ids.pop(using, None)
+    if recipe_ids:
+        update_search_index(sorted(recipe_ids))
+
+
+def schedule_search_index_update(recipe_ids):
+    # Изменения одной транзакции (рецепт и каждый его ингредиент)
+    # собираются в одно обновление индекса после коммита: первый
+    # сработавший колбэк забирает все id, остальные ничего не делают.
+    # id из откаченной транзакции уйдут со следующим обновлением,
+    # индекс просто перечитает эти рецепты из базы
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    using = transaction.get_connection().alias
+    pending.recipe_ids.setdefault(using, set()).update(recipe_ids)
+    transaction.on_commit(lambda: flush_search_index_update(using))
+
+
+def rebuild_search_index(queryset=None, batch_size=1000):
+    queryset = Recipe.objects.all() if queryset is None else queryset
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        update_search_index(ids[start:start + batch_size])
+    return len(ids)
+
+
+def to_fts_query(query):
+    # Каждое слово ищется как префикс, все слова обязательны
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, query):
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=settings.SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', 'name', 'id')
+
+    if connection.vendor == 'sqlite':
+        fts_query = to_fts_query(query)
+        if not fts_query:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [fts_query]
+        )).annotate(rank=RawSQL(
+            # Имя рецепта весит больше ингредиентов и описания
+            f'SELECT bm25({FTS_TABLE}, 10.0, 1.0, 5.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipes_recipe.id',
+            [fts_query]
+        )).order_by('rank', 'name', 'id')
+
+    return queryset.filter(name__icontains=query)
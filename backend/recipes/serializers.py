@@ -1,7 +1,12 @@
-from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.models import (
+    Recipe, Ingredient, RecipeIngredient, ShoppingCartItem)
+from recipes.shopping_list import (
+    update_shopping_lists, updating_shopping_lists)
 from rest_framework import serializers
+from backend.images import thumbnail_urls
 from backend.serializers import Base64ImageField
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 User = get_user_model()
@@ -15,7 +20,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     name = serializers.CharField(source='ingredient.name', read_only=True)
     measurement_unit = serializers.CharField(
         source='ingredient.measurement_unit', read_only=True)
@@ -48,6 +53,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
     image = Base64ImageField()
+    thumbnails = serializers.SerializerMethodField(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         many=True,
         source='ingredient_amounts',
@@ -56,55 +62,123 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'author', 'image',
+        fields = ('id', 'name', 'author', 'image', 'thumbnails',
                   'text', 'ingredients', 'cooking_time', 'is_favorited', 'is_in_shopping_cart')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            ids = getattr(request.user, 'favorite_ids', None)
+            if ids is not None:
+                return obj.pk in ids
             return request.user.favorites.filter(pk=obj.pk).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            ids = getattr(request.user, 'cart_ids', None)
+            if ids is not None:
+                return obj.pk in ids
             return request.user.shopping_card.filter(pk=obj.pk).exists()
         return False
 
     def get_author(self, obj):
         from users.serializers import CustomUserViewSerializer
+        if hasattr(obj, 'author_is_subscribed'):
+            obj.author.is_subscribed = obj.author_is_subscribed
         return CustomUserViewSerializer(obj.author, context=self.context).data
 
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(
+            obj.image, 'recipe', self.context.get('request'))
+
     def get_image(self, obj):
         if obj.image:
             request = self.context.get('request')
             return request.build_absolute_uri(obj.image.url)
         return None
 
-    def create(self, validated_data):
-        ingredients_data = validated_data.pop('ingredient_amounts')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.image = validated_data.get('image')
+    def validate_ingredients(self, value):
+        ids = [item['ingredient'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться')
+
+        # Все id проверяются одним запросом
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in ingredients]
+        if missing:
+            raise serializers.ValidationError(
+                f'Недопустимый первичный ключ "{missing[0]}" - '
+                'объект не существует.')
+
+        for item in value:
+            item['ingredient'] = ingredients[item['ingredient']]
+        return value
+
+    def set_ingredients(self, recipe, ingredients_data):
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.ingredient_amounts.all()
+        }
+        amounts = {
+            item['ingredient'].id: item['amount']
+            for item in ingredients_data
+        }
 
-        for ingredient_data in ingredients_data:
-            RecipeIngredient.objects.create(
+        removed = existing.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            item = existing.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient_data['ingredient'],
-                amount=ingredient_data['amount']
+                ingredient_id=ingredient_id,
+                amount=amount
             )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ])
+        recipe.ingredients_count = len(amounts)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            ingredients_count=recipe.ingredients_count)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        ingredients_data = validated_data.pop('ingredient_amounts')
+        recipe = Recipe.objects.create(**validated_data)
+        self.set_ingredients(recipe, ingredients_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredient_amounts', None)
 
         if ingredients_data is not None:
-            instance.ingredients.clear()
-            for ingredient_data in ingredients_data:
-                RecipeIngredient.objects.create(
-                    recipe=instance,
-                    ingredient=ingredient_data['ingredient'],
-                    amount=ingredient_data['amount']
-                )
+            # Списки покупок тех, у кого рецепт в корзине: старый состав
+            # вычитается, новый прибавляется
+            in_carts = ShoppingCartItem.objects.filter(
+                recipe=instance).exists()
+            with updating_shopping_lists():
+                if in_carts:
+                    update_shopping_lists([instance.pk], -1)
+                self.set_ingredients(instance, ingredients_data)
+                if in_carts:
+                    update_shopping_lists([instance.pk], 1)
 
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
@@ -0,0 +1,203 @@
+import csv
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Sum
+
+from recipes.models import (
+    RecipeIngredient, ShoppingCartItem, ShoppingListItem)
+
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class ExplicitUpdates(threading.local):
+    active = False
+
+
+explicit_updates = ExplicitUpdates()
+
+
+@contextmanager
+def updating_shopping_lists():
+    """Блок, в котором списки покупок пересчитывает сам вызывающий код.
+
+    Сигналы состава рецепта (recipes.signals) внутри блока списки
+    не трогают, иначе изменение учлось бы дважды.
+    """
+    previous, explicit_updates.active = explicit_updates.active, True
+    try:
+        yield
+    finally:
+        explicit_updates.active = previous
+
+
+def get_shopping_list(user):
+    # Готовые суммы из ShoppingListItem, без агрегации по корзине
+    return (
+        ShoppingListItem.objects
+        .filter(user=user)
+        .values('ingredient__name', 'ingredient__measurement_unit')
+        .annotate(amount=F('total_amount'))
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+    )
+
+
+def update_shopping_lists(recipe_ids, sign, user=None,
+                          ingredient_ids=None):
+    """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов.
+
+    С user меняется список одного пользователя, без него - списки всех,
+    у кого рецепты в корзине. recipe_ids=None берёт все рецепты,
+    ingredient_ids ограничивает состав отдельными ингредиентами.
+    Один INSERT ... ON CONFLICT DO UPDATE при любом числе строк.
+    """
+    quote = connection.ops.quote_name
+    items = quote(ShoppingListItem._meta.db_table)
+    amounts = quote(RecipeIngredient._meta.db_table)
+    cart = quote(ShoppingCartItem._meta.db_table)
+
+    params = []
+    if user is not None:
+        select = 'SELECT %s, ri.ingredient_id, SUM(ri.amount) * %s'
+        source = f'FROM {amounts} ri'
+        group = 'GROUP BY ri.ingredient_id'
+        params += [user.pk, sign]
+    else:
+        select = 'SELECT cart.user_id, ri.ingredient_id, SUM(ri.amount) * %s'
+        source = (f'FROM {amounts} ri JOIN {cart} cart '
+                  'ON cart.recipe_id = ri.recipe_id')
+        group = 'GROUP BY cart.user_id, ri.ingredient_id'
+        params.append(sign)
+
+    # WHERE обязателен: без него SQLite не разберёт INSERT ... SELECT
+    # с ON CONFLICT
+    if recipe_ids is None:
+        where = 'WHERE 1 = 1'
+    else:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        where = 'WHERE ri.recipe_id IN ({})'.format(
+            ', '.join(['%s'] * len(recipe_ids)))
+        params += recipe_ids
+    if ingredient_ids is not None:
+        where += ' AND ri.ingredient_id IN ({})'.format(
+            ', '.join(['%s'] * len(ingredient_ids)))
+        params += list(ingredient_ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {items} (user_id, ingredient_id, total_amount) '
+            f'{select} {source} {where} {group} '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+            f'SET total_amount = {items}.total_amount '
+            '+ excluded.total_amount',
+            params
+        )
+
+    if sign < 0:
+        emptied = ShoppingListItem.objects.filter(total_amount__lte=0)
+        if user is not None:
+            emptied = emptied.filter(user=user)
+        elif recipe_ids is not None:
+            emptied = emptied.filter(
+                ingredient__in=RecipeIngredient.objects.filter(
+                    recipe__in=recipe_ids).values('ingredient'))
+        emptied.delete()
+
+
+def expected_shopping_lists():
+    return {
+        (row['user_id'], row['ingredient_id']): row['total']
+        for row in ShoppingCartItem.objects
+        .filter(recipe__ingredient_amounts__isnull=False)
+        .values('user_id',
+                ingredient_id=F('recipe__ingredient_amounts__ingredient'))
+        .annotate(total=Sum('recipe__ingredient_amounts__amount'))
+        .order_by()
+    }
+
+
+def rebuild_shopping_lists():
+    ShoppingListItem.objects.all().delete()
+    update_shopping_lists(None, 1)
+
+
+def render_txt(rows):
+    yield 'Список покупок:\n'
+    for row in rows:
+        yield (f"{row['ingredient__name']} "
+               f"({row['ingredient__measurement_unit']}) — {row['amount']}\n")
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for row in rows:
+        yield writer.writerow((
+            row['ingredient__name'],
+            row['ingredient__measurement_unit'],
+            row['amount'],
+        ))
+
+
+def get_pdf_font():
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    path = settings.SHOPPING_LIST_PDF_FONT
+    if not os.path.exists(path):
+        return 'Helvetica'
+    if 'ShoppingList' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('ShoppingList', path))
+    return 'ShoppingList'
+
+
+def render_pdf(rows):
+    # reportlab собирает документ целиком, поэтому готовый файл
+    # отдаётся частями
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    font = get_pdf_font()
+    width, height = A4
+    y = height - 50
+
+    pdf.setFont(font, 16)
+    pdf.drawString(50, y, 'Список покупок:')
+    y -= 30
+    pdf.setFont(font, 12)
+    for row in rows:
+        if y < 50:
+            pdf.showPage()
+            pdf.setFont(font, 12)
+            y = height - 50
+        pdf.drawString(
+            50, y,
+            f"{row['ingredient__name']} "
+            f"({row['ingredient__measurement_unit']}) — {row['amount']}"
+        )
+        y -= 20
+    pdf.save()
+
+    buffer.seek(0)
+    while chunk := buffer.read(PDF_CHUNK_SIZE):
+        yield chunk
+
+
+RENDERERS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
@@ -0,0 +1,154 @@
+"""Короткие ссылки на рецепты.
+
+Код - base62 от перемешанного id рецепта. Отображение id -> код
+взаимно однозначно, поэтому параллельные запросы не получают один код
+и повторные попытки вставки не нужны: гонку за одну и ту же ссылку
+разрешает get_or_create по уникальному recipe.
+"""
+import atexit
+import logging
+import string
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Case, F, Value, When
+
+from backend.cache import LocalCache
+from recipes.models import ShortLink
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+# Нечётно и не делится на 31, то есть взаимно просто с 62 ** 6
+MULTIPLIER = 27182818283
+
+
+def encode(number):
+    digits = []
+    while True:
+        number, rest = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[rest])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def make_code(recipe_id):
+    if recipe_id < CODE_SPACE:
+        return encode(recipe_id * MULTIPLIER % CODE_SPACE).rjust(
+            CODE_LENGTH, ALPHABET[0])
+    # Длиннее CODE_LENGTH символов, с перемешанными кодами не пересекается
+    return encode(recipe_id)
+
+
+def get_short_link(recipe_id):
+    link, _ = ShortLink.objects.get_or_create(
+        recipe_id=recipe_id, defaults={'code': make_code(recipe_id)})
+    return link
+
+
+class ShortLinkResolver:
+    """Код -> id рецепта: LRU процесса, затем общий кэш, затем база."""
+
+    def __init__(self):
+        self.local = LocalCache(
+            settings.SHORT_LINK_CACHE_SIZE, settings.SHORT_LINK_LOCAL_TIMEOUT)
+
+    @staticmethod
+    def cache_key(code):
+        return f'short-link:{code}'
+
+    def resolve(self, code):
+        recipe_id = self.local.get(code)
+        if recipe_id is not None:
+            return recipe_id
+
+        recipe_id = cache.get(self.cache_key(code))
+        if recipe_id is None:
+            recipe_id = ShortLink.objects.filter(code=code).values_list(
+                'recipe_id', flat=True).first()
+            if recipe_id is None:
+                return None
+            cache.set(self.cache_key(code), recipe_id,
+                      settings.SHORT_LINK_CACHE_TIMEOUT)
+        self.local.set(code, recipe_id)
+        return recipe_id
+
+    def forget(self, code):
+        self.local.delete(code)
+        cache.delete(self.cache_key(code))
+
+
+class HitCounter:
+    """Буфер переходов: один UPDATE на пачку вместо записи на клик.
+
+    Пачка пишется, когда набралось SHORT_LINK_HITS_FLUSH_SIZE переходов,
+    по таймеру через SHORT_LINK_HITS_FLUSH_INTERVAL секунд после первого
+    перехода в пачке, даже если новых переходов нет, и при выходе
+    процесса. Запись идёт в фоновом потоке, а не в запросе перехода.
+    """
+
+    def __init__(self):
+        self.pending = Counter()
+        self.total = 0
+        self.scheduled = False
+        self.timer = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='short-link-hits')
+
+    def add(self, code):
+        with self.lock:
+            first = not self.pending
+            self.pending[code] += 1
+            self.total += 1
+        if first:
+            self.timer = threading.Timer(
+                settings.SHORT_LINK_HITS_FLUSH_INTERVAL, self.schedule_flush)
+            self.timer.daemon = True
+            self.timer.start()
+        if self.total >= settings.SHORT_LINK_HITS_FLUSH_SIZE:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        with self.lock:
+            if self.scheduled or not self.pending:
+                return
+            self.scheduled = True
+        self.executor.submit(self.run_flush)
+
+    def run_flush(self):
+        try:
+            self.flush()
+        finally:
+            self.scheduled = False
+            # Соединение фонового потока не закрывается обработкой запроса
+            connection.close()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.total = 0
+        if not pending:
+            return
+        increment = Case(
+            *(When(code=code, then=Value(count))
+              for code, count in pending.items()),
+            default=Value(0)
+        )
+        try:
+            ShortLink.objects.filter(code__in=pending).update(
+                hits=F('hits') + increment)
+        except DatabaseError:
+            logger.exception('Не удалось записать %s переходов',
+                             sum(pending.values()))
+
+
+short_links = ShortLinkResolver()
+hit_counter = HitCounter()
+atexit.register(hit_counter.flush)
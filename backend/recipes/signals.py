@@ -0,0 +1,207 @@
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from backend.cache import invalidate
+from backend.images import schedule_thumbnails
+from recipes.autocomplete import ingredient_index
+from recipes.matching import recipe_match_index
+from recipes.models import Ingredient, Recipe, RecipeIngredient, ShortLink
+from recipes.shopping_list import explicit_updates, update_shopping_lists
+from recipes.short_links import short_links
+from recipes.summaries import author_namespace
+from recipes.search import (
+    create_fts_table, fts_table_exists, rebuild_search_index,
+    schedule_search_index_update)
+
+User = get_user_model()
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name', 'avatar'}
+
+POSTGRES_INDEXES = [
+    # Поиск по префиксу без учёта регистра: LOWER(name) LIKE 'x%'
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_lower_idx '
+    'ON recipes_ingredient (LOWER(name) varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+]
+
+
+def create_database_indexes(using, **kwargs):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for sql in POSTGRES_INDEXES:
+                cursor.execute(sql)
+        rebuild_search_index(
+            Recipe.objects.using(using).filter(search_vector__isnull=True))
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            created = not fts_table_exists(cursor)
+            create_fts_table(cursor)
+        if created:
+            rebuild_search_index(Recipe.objects.using(using))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_cache(sender, instance, created=False, **kwargs):
+    namespaces = ['ingredients', f'ingredients:{instance.pk}']
+    if kwargs['signal'] is post_save and not created:
+        # Переименование ингредиента меняет рецепты, в которых он есть.
+        # При удалении это делают каскадные удаления RecipeIngredient
+        recipe_ids = RecipeIngredient.objects.filter(
+            ingredient=instance).values_list('recipe_id', flat=True)
+        namespaces += ['recipes'] + [f'recipes:{pk}' for pk in recipe_ids]
+        author_ids = Recipe.objects.filter(pk__in=recipe_ids).values_list(
+            'author_id', flat=True).distinct()
+        namespaces += [author_namespace(pk) for pk in author_ids]
+        schedule_search_index_update(recipe_ids)
+    invalidate(*namespaces)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def invalidate_ingredient_authors_cache(sender, instance, **kwargs):
+    # Каскадное удаление RecipeIngredient не знает авторов рецептов
+    author_ids = Recipe.objects.filter(
+        ingredient_amounts__ingredient=instance).values_list(
+        'author_id', flat=True).distinct()
+    invalidate(*(author_namespace(pk) for pk in author_ids))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def update_ingredients_count(sender, instance, **kwargs):
+    Recipe.objects.filter(ingredient_amounts__ingredient=instance).update(
+        ingredients_count=F('ingredients_count') - 1)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_cache(sender, instance, **kwargs):
+    invalidate('recipes', f'recipes:{instance.pk}',
+               author_namespace(instance.author_id))
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredient_cache(sender, instance, **kwargs):
+    namespaces = ['recipes', f'recipes:{instance.recipe_id}']
+    if kwargs['signal'] is post_save:
+        # Удаления идут каскадом от рецепта или из set_ingredients перед
+        # сохранением рецепта, автора сбросит сигнал Recipe
+        namespaces += [
+            author_namespace(pk) for pk in Recipe.objects.filter(
+                pk=instance.recipe_id).values_list('author_id', flat=True)]
+    invalidate(*namespaces)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_cache(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not AUTHOR_FIELDS & set(update_fields):
+        return
+    recipe_ids = list(instance.recipes.values_list('id', flat=True))
+    if recipe_ids:
+        invalidate('recipes', author_namespace(instance.pk),
+                   *(f'recipes:{pk}' for pk in recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_thumbnails(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance.image:
+        schedule_thumbnails(instance.image.name, 'recipe')
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_search_index(sender, instance, **kwargs):
+    schedule_search_index_update([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def update_recipe_ingredient_search_index(sender, instance, **kwargs):
+    schedule_search_index_update([instance.recipe_id])
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_match_index(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: recipe_match_index.mark_stale([instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def update_recipe_ingredient_match_index(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: recipe_match_index.mark_stale([instance.recipe_id]))
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    # Пока строки корзины и состав рецепта ещё не удалены каскадом
+    update_shopping_lists([instance.pk], -1)
+
+
+# Правки состава рецепта мимо set_ingredients (shell, скрипты).
+# set_ingredients пересчитывает списки сам, см. updating_shopping_lists
+@receiver(pre_save, sender=RecipeIngredient)
+def subtract_old_ingredient_amount(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or explicit_updates.active:
+        return
+    old = RecipeIngredient.objects.filter(pk=instance.pk).values_list(
+        'recipe_id', 'ingredient_id').first()
+    if old is not None:
+        update_shopping_lists([old[0]], -1, ingredient_ids=[old[1]])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def add_ingredient_amount(sender, instance, raw=False, **kwargs):
+    if raw or explicit_updates.active:
+        return
+    update_shopping_lists(
+        [instance.recipe_id], 1, ingredient_ids=[instance.ingredient_id])
+
+
+@receiver(pre_delete, sender=RecipeIngredient)
+def subtract_deleted_ingredient_amount(sender, instance, origin=None,
+                                       **kwargs):
+    # Каскад от рецепта, ингредиента или пользователя пропускаем: списки
+    # уже пересчитаны сигналом рецепта или удаляются вместе с остальным
+    direct = isinstance(origin, RecipeIngredient) or (
+        isinstance(origin, QuerySet) and origin.model is RecipeIngredient)
+    if not direct or explicit_updates.active:
+        return
+    update_shopping_lists(
+        [instance.recipe_id], -1, ingredient_ids=[instance.ingredient_id])
+
+
+@receiver(pre_save, sender=ShortLink)
+def remember_old_short_link(sender, instance, raw=False, **kwargs):
+    instance.old_code = None
+    if not raw and not instance._state.adding:
+        instance.old_code = ShortLink.objects.filter(
+            pk=instance.pk).values_list('code', flat=True).first()
+
+
+@receiver(post_save, sender=ShortLink)
+def forget_changed_short_link(sender, instance, created, **kwargs):
+    # Изменённый код или рецепт иначе резолвился бы из кэша ещё сутки
+    if created:
+        return
+    codes = {instance.old_code, instance.code} - {None}
+
+    def forget():
+        for code in codes:
+            short_links.forget(code)
+
+    forget()
+    transaction.on_commit(forget)
+
+
+@receiver(post_delete, sender=ShortLink)
+def forget_short_link(sender, instance, **kwargs):
+    short_links.forget(instance.code)
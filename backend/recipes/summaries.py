@@ -0,0 +1,78 @@
+"""Кэш кратких карточек рецептов по авторам.
+
+Для каждого автора хранится число его рецептов и первые
+AUTHOR_RECIPES_CACHE_SIZE карточек (id, name, image, cooking_time) в
+порядке ShortRecipeSerializer. Ключ включает версию пространства
+authors:<id>, которое сбрасывают сигналы при изменении рецептов автора.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from backend.cache import get_versions
+from recipes.models import Recipe
+
+
+def author_namespace(author_id):
+    return f'authors:{author_id}'
+
+
+def load_summaries(author_ids, size):
+    # Два запроса на любое число авторов: первые size рецептов каждого
+    # через ROW_NUMBER() и число рецептов через GROUP BY
+    recipes = Recipe.objects.filter(author_id__in=author_ids)
+    summaries = {pk: {'count': 0, 'recipes': []} for pk in author_ids}
+    counts = recipes.order_by().values('author_id').annotate(
+        count=Count('id')).values_list('author_id', 'count')
+    for author_id, count in counts:
+        summaries[author_id]['count'] = count
+
+    rows = recipes.annotate(position=Window(
+        RowNumber(),
+        partition_by=F('author_id'),
+        order_by=[F('name').asc(), F('id').asc()],
+    )).filter(position__lte=size).order_by('author_id', 'name', 'id')
+    for row in rows.values('author_id', 'id', 'name', 'image',
+                           'cooking_time'):
+        summaries[row.pop('author_id')]['recipes'].append(row)
+    return summaries
+
+
+def cut(summaries, limit):
+    return {
+        pk: {'count': summary['count'], 'recipes': summary['recipes'][:limit]}
+        for pk, summary in summaries.items()
+    }
+
+
+def cache_keys(author_ids, versions):
+    return {
+        f'author-recipes:{pk}:{version}': pk
+        for pk, version in zip(author_ids, versions)
+    }
+
+
+def get_author_summaries(author_ids, limit):
+    """{author_id: {'count': n, 'recipes': [...]}}, до limit карточек."""
+    author_ids = list(dict.fromkeys(author_ids))
+    size = settings.AUTHOR_RECIPES_CACHE_SIZE
+    if not author_ids or limit > size:
+        return cut(load_summaries(author_ids, limit), limit)
+
+    keys = cache_keys(author_ids, get_versions(
+        *map(author_namespace, author_ids)))
+    cached = cache.get_many(keys)
+    summaries = {keys[key]: value for key, value in cached.items()}
+    missing = [pk for key, pk in keys.items() if key not in cached]
+    if missing:
+        loaded = load_summaries(missing, size)
+        cache.set_many(
+            {key: loaded[pk] for key, pk in keys.items() if pk in loaded},
+            settings.AUTHOR_RECIPES_CACHE_TIMEOUT)
+        summaries.update(loaded)
+    return cut(summaries, limit)
+
+
+aget_author_summaries = sync_to_async(get_author_summaries)
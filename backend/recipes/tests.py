@@ -1,3 +1,1256 @@
-from django.test import TestCase
+import base64
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+import yaml
+
+from backend.middleware import QueryBudgetExceeded, fingerprint
+from backend.images import (
+    MediaUrls, created_thumbnails, thumbnail_name)
+from backend.renderers import ORJSONRenderer
+from backend.serializers import DECODE_CHUNK_SIZE
+
+from recipes.autocomplete import ingredient_index
+from recipes.benchmark import Benchmark, Scale, compare, seed
+from recipes.matching import recipe_match_index
+from recipes.management.commands.rebuild_shopping_lists import (
+    find_mismatches)
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCartItem,
+    ShoppingListItem, ShortLink, SimilarRecipe, TimelineEntry)
+from recipes.representations import recipe_row
+from recipes.serializers import RecipeSerializer
+from recipes.short_links import (
+    get_short_link, hit_counter, make_code, short_links)
+from recipes.timeline import publish
+from users.models import Subscription
+
+User = get_user_model()
+
+OPENAPI_SCHEMA = settings.BASE_DIR.parent / 'docs' / 'openapi-schema.yml'
+
+
+def create_user(username, **kwargs):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@user.com',
+        password='foo',
+        first_name=username,
+        last_name=username,
+        **kwargs
+    )
+
+
+def create_recipes(author, count, ingredients):
+    recipes = Recipe.objects.bulk_create([
+        Recipe(
+            author=author,
+            name=f'Рецепт {author.username} {i}',
+            image='recipes/images/test.png',
+            text='описание',
+            cooking_time=10,
+            ingredients_count=len(ingredients),
+        )
+        for i in range(count)
+    ])
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+        for recipe in recipes
+        for ingredient in ingredients
+    ])
+    return recipes
+
+
+class RecipeListQueriesTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('reader')
+        self.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(3)
+        ])
+        self.client.force_authenticate(self.user)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        author = create_user('author')
+        recipes = create_recipes(author, 2, self.ingredients)
+        self.user.favorites.add(recipes[0])
+        self.user.subscriptions.add(author)
+        small, _ = self.count_list_queries()
+
+        other = create_user('other')
+        create_recipes(other, 10, self.ingredients)
+        large, response = self.count_list_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data), 12)
+
+    def test_flags_come_from_annotations(self):
+        author = create_user('author')
+        favorite, carted = create_recipes(author, 2, self.ingredients)
+        self.user.favorites.add(favorite)
+        self.user.shopping_card.add(carted)
+        self.user.subscriptions.add(author)
+
+        _, response = self.count_list_queries()
+        data = {recipe['id']: recipe for recipe in response.data}
+
+        self.assertTrue(data[favorite.id]['is_favorited'])
+        self.assertFalse(data[favorite.id]['is_in_shopping_cart'])
+        self.assertTrue(data[carted.id]['is_in_shopping_cart'])
+        self.assertTrue(data[carted.id]['author']['is_subscribed'])
+        self.assertEqual(len(data[carted.id]['ingredients']), 3)
+
+
+class ShoppingListDownloadTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('buyer')
+        self.token = Token.objects.create(user=self.user)
+        ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name='сахар', measurement_unit='г'),
+            Ingredient(name='молоко', measurement_unit='мл'),
+        ])
+        recipes = create_recipes(self.user, 3, ingredients)
+        self.client.force_authenticate(self.user)
+        self.client.post(
+            '/api/recipes/shopping_cart/',
+            {'ids': [recipe.id for recipe in recipes]}, format='json')
+
+    def get(self, file_format):
+        return self.async_client.get(
+            '/api/recipes/download_shopping_cart/', {'format': file_format},
+            headers={'Authorization': f'Token {self.token.key}'})
+
+    async def download(self, file_format):
+        response = await self.get(file_format)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(
+            [chunk async for chunk in response.streaming_content])
+
+    async def test_txt_is_aggregated(self):
+        content = (await self.download('txt')).decode()
+        self.assertEqual(content.splitlines(), [
+            'Список покупок:',
+            'молоко (мл) — 15',
+            'сахар (г) — 15',
+        ])
+
+    async def test_csv_and_pdf(self):
+        rows = (await self.download('csv')).decode().splitlines()
+        self.assertEqual(rows[1:], ['молоко,мл,15', 'сахар,г,15'])
+        self.assertTrue((await self.download('pdf')).startswith(b'%PDF'))
+
+    async def test_unknown_format(self):
+        response = await self.get('doc')
+        self.assertEqual(response.status_code, 400)
+
+
+class LoadIngredientsCommandTest(TestCase):
+    def test_load_is_idempotent(self):
+        for path in ('data/ingredients.csv', 'data/ingredients.json'):
+            call_command(
+                'load_ingredients', settings.BASE_DIR / path,
+                batch_size=500, stdout=StringIO())
+        self.assertEqual(Ingredient.objects.count(), 2186)
+        self.assertTrue(Ingredient.objects.filter(
+            name='абрикосовое варенье', measurement_unit='г').exists())
+
+
+class IngredientAutocompleteTest(APITestCase):
+    def setUp(self):
+        Ingredient.objects.bulk_create([
+            Ingredient(name='Абрикосы', measurement_unit='г'),
+            Ingredient(name='абрикосовый сок', measurement_unit='мл'),
+            Ingredient(name='авокадо', measurement_unit='г'),
+        ])
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_search_from_memory(self):
+        self.client.get('/api/ingredients/', {'name': 'а'})
+        self.assertEqual(
+            self.search('абрикос'), ['абрикосовый сок', 'Абрикосы'])
+        self.assertEqual(self.search('ав'), ['авокадо'])
+        self.assertEqual(self.search('я'), [])
+
+    def test_index_invalidated_on_save(self):
+        self.client.get('/api/ingredients/', {'name': 'а'})
+        Ingredient.objects.create(name='агар-агар', measurement_unit='г')
+        response = self.client.get('/api/ingredients/', {'name': 'аг'})
+        self.assertEqual(response.data[0]['name'], 'агар-агар')
+
+    @override_settings(INGREDIENT_INDEX_ENABLED=False)
+    def test_database_fallback(self):
+        response = self.client.get('/api/ingredients/', {'name': 'ав'})
+        self.assertEqual(response.data[0]['name'], 'авокадо')
+
+
+class AnonymousResponseCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = create_user('author')
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        self.recipe, = create_recipes(self.author, 1, [ingredient])
+
+    def test_list_is_cached_until_recipe_changes(self):
+        first = self.client.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/recipes/')
+        self.assertEqual(first.data, second.data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data[0]['name'], 'Новое название')
+
+    def test_detail_invalidated_by_author_change(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Иван'
+            self.author.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['author']['first_name'], 'Иван')
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get('/api/recipes/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+
+def make_image_payload(size=(600, 400)):
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert('RGB').save(buffer, format='PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class RecipeImageTest(APITestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        created_thumbnails.clear()
+        self.user = create_user('cook')
+        self.client.force_authenticate(self.user)
+        self.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+
+    def test_upload_and_thumbnails(self):
+        payload = make_image_payload()
+        self.assertGreater(len(payload), DECODE_CHUNK_SIZE)
+        response = self.client.post('/api/recipes/', {
+            'name': 'Хлеб',
+            'text': 'испечь',
+            'cooking_time': 60,
+            'image': payload,
+            'ingredients': [{'id': self.ingredient.id, 'amount': 500}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        # Миниатюры ещё не созданы: ссылок на несуществующие файлы нет
+        self.assertIsNone(response.data['thumbnails'])
+
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        out = StringIO()
+        call_command('make_thumbnails', stdout=out)
+        self.assertIn('Проверено изображений: 1', out.getvalue())
+        card = thumbnail_name(recipe.image.name, 'card')
+        with default_storage.open(card) as file:
+            self.assertLessEqual(max(Image.open(file).size), 480)
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(
+            set(response.data['thumbnails']), {'card', 'detail'})
+
+    def test_base64_with_line_breaks(self):
+        payload = make_image_payload((60, 40))
+        header, encoded = payload.split(',', 1)
+        wrapped = '\n'.join(
+            encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        response = self.client.post('/api/recipes/', {
+            'name': 'Хлеб',
+            'text': 'испечь',
+            'cooking_time': 60,
+            'image': f'{header},{wrapped}\n',
+            'ingredients': [{'id': self.ingredient.id, 'amount': 500}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_invalid_base64(self):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Хлеб',
+            'text': 'испечь',
+            'cooking_time': 60,
+            'image': 'data:image/png;base64,!!!!',
+            'ingredients': [{'id': self.ingredient.id, 'amount': 500}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+
+class RecipeIngredientsWriteTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('cook')
+        self.client.force_authenticate(self.user)
+        self.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(4)
+        ])
+        self.recipe, = create_recipes(self.user, 1, self.ingredients[:3])
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def test_update_applies_diff(self):
+        first, second, third, fourth = self.ingredients
+        kept = RecipeIngredient.objects.get(
+            recipe=self.recipe, ingredient=first)
+
+        response = self.client.patch(self.url, {'ingredients': [
+            {'id': first.id, 'amount': 5},
+            {'id': second.id, 'amount': 50},
+            {'id': fourth.id, 'amount': 7},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        amounts = dict(self.recipe.ingredient_amounts.values_list(
+            'ingredient_id', 'amount'))
+        self.assertEqual(
+            amounts, {first.id: 5, second.id: 50, fourth.id: 7})
+        self.assertTrue(RecipeIngredient.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(
+            {item['id'] for item in response.data['ingredients']},
+            {first.id, second.id, fourth.id})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredients_count, 3)
+
+    def test_unknown_and_duplicate_ingredients(self):
+        first = self.ingredients[0]
+        for ingredients in (
+            [{'id': first.id, 'amount': 1}, {'id': 10 ** 6, 'amount': 1}],
+            [{'id': first.id, 'amount': 1}, {'id': first.id, 'amount': 2}],
+        ):
+            response = self.client.patch(
+                self.url, {'ingredients': ingredients}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ingredients', response.data)
+        self.assertEqual(self.recipe.ingredient_amounts.count(), 3)
+
+
+class RecipeSearchTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('cook')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            tomato, basil, flour = Ingredient.objects.bulk_create([
+                Ingredient(name='помидоры', measurement_unit='г'),
+                Ingredient(name='базилик', measurement_unit='г'),
+                Ingredient(name='мука', measurement_unit='г'),
+            ])
+            self.soup = Recipe.objects.create(
+                author=self.user, name='Томатный суп', text='Сварить',
+                image='recipes/images/test.png', cooking_time=30)
+            RecipeIngredient.objects.create(
+                recipe=self.soup, ingredient=tomato, amount=300)
+            self.pizza = Recipe.objects.create(
+                author=self.user, name='Пицца', text='Суп не нужен',
+                image='recipes/images/test.png', cooking_time=40)
+            RecipeIngredient.objects.create(
+                recipe=self.pizza, ingredient=basil, amount=10)
+            RecipeIngredient.objects.create(
+                recipe=self.pizza, ingredient=flour, amount=500)
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data]
+
+    def test_name_ranks_above_text(self):
+        self.assertEqual(self.search('суп'), [self.soup.id, self.pizza.id])
+
+    def test_ingredients_and_prefixes(self):
+        self.assertEqual(self.search('базил'), [self.pizza.id])
+        self.assertEqual(self.search('мука пицца'), [self.pizza.id])
+        self.assertEqual(self.search('шоколад'), [])
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pizza.name = 'Фокачча'
+            self.pizza.save()
+        self.assertEqual(self.search('пицца'), [])
+        self.assertEqual(self.search('фокачча'), [self.pizza.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.delete()
+        self.assertEqual(self.search('томатный'), [])
+
+    def test_updates_coalesce_per_transaction(self):
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks(execute=True):
+                for name in ('Фокачча', 'Кальцоне'):
+                    self.pizza.name = name
+                    self.pizza.save()
+                self.soup.save()
+        fts = [query for query in context.captured_queries
+               if 'recipes_recipe_fts' in query['sql']]
+        # Одно удаление и одна вставка на всю транзакцию
+        self.assertEqual(len(fts), 2)
+        self.assertEqual(self.search('кальцоне'), [self.pizza.id])
+
+
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('reader')
+        self.client.force_authenticate(self.user)
+        author = create_user('author')
+        create_recipes(author, 7, [])
+        # Одинаковые названия различаются только по id
+        create_recipes(author, 3, [])
+
+    def test_cursor_walks_all_recipes_in_order(self):
+        expected = list(
+            Recipe.objects.order_by('name', 'id').values_list('id', flat=True))
+        seen = []
+        url = '/api/recipes/?cursor=&limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['count'])
+            self.assertIsNone(response.data['previous'])
+            seen += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'abc'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_offset_without_count(self):
+        response = self.client.get(
+            '/api/recipes/', {'limit': 4, 'offset': 8, 'count': 'none'})
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+        self.assertIn('offset=4', response.data['previous'])
+
+        response = self.client.get(
+            '/api/recipes/', {'limit': 4, 'count': 'estimate'})
+        self.assertEqual(response.data['count'], 10)
+        self.assertIn('offset=4', response.data['next'])
+
+
+@override_settings(
+    QUERY_PROFILER={**settings.QUERY_PROFILER, 'ENABLED': True})
+class QueryProfilerTest(APITestCase):
+    def setUp(self):
+        author = create_user('author')
+        create_recipes(author, 3, [])
+        self.user = create_user('reader')
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/recipes/')
+        metrics = [
+            item.split(';')[0] for item in
+            response['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(
+            metrics, ['db', 'app', 'serialize', 'render', 'total'])
+
+    def test_strict_mode_enforces_budget(self):
+        config = {**settings.QUERY_PROFILER, 'STRICT': True}
+        with override_settings(QUERY_PROFILER={**config, 'QUERY_BUDGET': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/recipes/')
+        with override_settings(QUERY_PROFILER={**config, 'QUERY_BUDGET': 5}):
+            self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+
+    def test_fingerprint_groups_repeated_queries(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 5 AND name = 'a'"),
+            fingerprint("SELECT * FROM t WHERE id = 17 AND name = 'b'"),
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            'SELECT * FROM t WHERE id IN (...)',
+        )
+
+
+class BenchmarkSuiteTest(TestCase):
+    def test_small_run_and_regression_check(self):
+        user = seed(Scale(users=3, recipes=6, ingredients=10,
+                          favorites=2, carts=2, subscriptions=1))
+        results = Benchmark(user, iterations=2).run(
+            ['recipe_list', 'shopping_list', 'subscriptions'])
+
+        self.assertEqual(set(results), {
+            'recipe_list', 'shopping_list', 'subscriptions'})
+        for result in results.values():
+            self.assertEqual(result['requests'], 2)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+        slower = {
+            name: {**result, 'p50_ms': result['p50_ms'] * 2}
+            for name, result in results.items()
+        }
+        self.assertEqual(compare(results, results, 0.2), [])
+        self.assertEqual(len(compare(slower, results, 0.2)), 3)
+
+
+class FavoritesCountTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('fan')
+        self.recipes = create_recipes(create_user('author'), 3, [])
+        self.client.force_authenticate(self.user)
+
+    def test_counter_follows_favorites(self):
+        url = f'/api/recipes/{self.recipes[1].id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(self.recipes[1].favorites_count, 1)
+        self.assertTrue(Favorite.objects.filter(
+            user=self.user, recipe=self.recipes[1]).exists())
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(self.recipes[1].favorites_count, 0)
+
+    def test_popular_ordering(self):
+        self.client.post(f'/api/recipes/{self.recipes[2].id}/favorite/')
+        other = create_user('other')
+        self.client.force_authenticate(other)
+        self.client.post(f'/api/recipes/{self.recipes[2].id}/favorite/')
+        self.client.post(f'/api/recipes/{self.recipes[0].id}/favorite/')
+
+        response = self.client.get('/api/recipes/', {'ordering': 'popular'})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [self.recipes[2].id, self.recipes[0].id, self.recipes[1].id])
+        self.assertTrue(response.data[0]['is_favorited'])
+
+        response = self.client.get(
+            '/api/recipes/', {'ordering': 'popular', 'cursor': ''})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.recipes[2].id, self.recipes[0].id, self.recipes[1].id])
+
+
+class CountersConsistencyTest(APITestCase):
+    def setUp(self):
+        self.author = create_user('author')
+        self.recipe, = create_recipes(self.author, 1, [])
+        self.fan = create_user('fan')
+        Favorite.objects.add(self.fan, self.recipe.id)
+        Subscription.objects.add(self.fan, self.author.id)
+        Recipe.objects.update(favorites_count=1)
+        User.objects.filter(pk=self.author.pk).update(subscribers_count=1)
+
+    def test_user_delete_updates_counters(self):
+        self.fan.delete()
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.author.subscribers_count, 0)
+
+    def test_recount_command(self):
+        Recipe.objects.update(favorites_count=7, ingredients_count=5)
+        User.objects.update(subscribers_count=3)
+        call_command('recount_counters', stdout=StringIO())
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        # Рецепт без ингредиентов: 0, а не NULL
+        self.assertEqual(self.recipe.ingredients_count, 0)
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertEqual(User.objects.get(pk=self.fan.pk).subscribers_count, 0)
+
+    def test_relation_admin_is_read_only(self):
+        admin = create_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        favorite = Favorite.objects.get()
+        self.assertEqual(self.client.get(
+            '/admin/recipes/favorite/add/').status_code, 403)
+        self.client.post(
+            f'/admin/recipes/favorite/{favorite.pk}/delete/', {'post': 'yes'})
+        self.assertTrue(Favorite.objects.filter(pk=favorite.pk).exists())
+
+
+class RecipeRelationToggleTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('clicker')
+        self.recipe = create_recipes(create_user('author'), 1, [])[0]
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_and_missing(self):
+        for name in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{self.recipe.id}/{name}/'
+            self.assertEqual(self.client.post(url).status_code, 201)
+            self.assertEqual(self.client.post(url).status_code, 400)
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 400)
+
+            missing = f'/api/recipes/{self.recipe.id + 100}/{name}/'
+            self.assertEqual(self.client.post(missing).status_code, 404)
+            self.assertEqual(self.client.delete(missing).status_code, 404)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_remove_is_single_statement(self):
+        Favorite.objects.add(self.user, self.recipe.id)
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(Favorite.objects.remove(self.user, self.recipe.id))
+        self.assertEqual(len(context.captured_queries), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(Favorite.objects.add(self.user, self.recipe.id))
+            self.assertFalse(
+                Favorite.objects.add(self.user, self.recipe.id))
+        self.assertEqual(len(context.captured_queries), 2)
+
+
+class BulkRecipeRelationTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('syncer')
+        self.recipes = create_recipes(create_user('author'), 5, [])
+        self.ids = [recipe.id for recipe in self.recipes]
+        self.client.force_authenticate(self.user)
+
+    def sync(self, method, ids):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(
+                '/api/recipes/favorite/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), [
+            (item['id'], item['status']) for item in response.data['results']]
+
+    def test_per_item_results(self):
+        Favorite.objects.add(self.user, self.ids[0])
+        missing = max(self.ids) + 1
+        _, results = self.sync('post', [self.ids[0], self.ids[1], missing])
+        self.assertEqual(
+            results, [(self.ids[0], 400), (self.ids[1], 201), (missing, 404)])
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(self.recipes[1].favorites_count, 1)
+
+        _, results = self.sync('delete', [self.ids[1], self.ids[2]])
+        self.assertEqual(results, [(self.ids[1], 204), (self.ids[2], 400)])
+        self.assertEqual(
+            list(self.user.favorites.values_list('id', flat=True)),
+            [self.ids[0]])
+
+    def test_changes_come_from_the_write(self):
+        # Связь, появившаяся или пропавшая мимо этого запроса (как при
+        # параллельном запросе), не меняет счётчик второй раз
+        Favorite.objects.add(self.user, self.ids[0])
+        Recipe.objects.filter(pk=self.ids[0]).update(favorites_count=1)
+        _, results = self.sync('post', self.ids[:2])
+        self.assertEqual(results, [(self.ids[0], 400), (self.ids[1], 201)])
+        Favorite.objects.filter(recipe_id=self.ids[1]).delete()
+        _, results = self.sync('delete', self.ids[:2])
+        self.assertEqual(results, [(self.ids[0], 204), (self.ids[1], 400)])
+        self.assertEqual(
+            dict(Recipe.objects.filter(pk__in=self.ids[:2]).values_list(
+                'id', 'favorites_count')),
+            {self.ids[0]: 0, self.ids[1]: 1})
+
+    def test_query_count_does_not_depend_on_batch(self):
+        small, _ = self.sync('post', self.ids[:1])
+        large, _ = self.sync('post', self.ids[1:])
+        self.assertEqual(small, large)
+        small, _ = self.sync('delete', self.ids[:1])
+        large, _ = self.sync('delete', self.ids[1:])
+        self.assertEqual(small, large)
+
+    def test_invalid_payload(self):
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'ids': ['x']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncReadViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('async_reader')
+        self.author = create_user('async_author')
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        self.recipes = create_recipes(self.author, 3, [ingredient])
+        Favorite.objects.add(self.user, self.recipes[0].id)
+        self.user.subscriptions.add(self.author)
+        self.headers = {
+            'Authorization':
+                f'Token {Token.objects.create(user=self.user).key}'}
+
+    async def get(self, url, **params):
+        response = await self.async_client.get(
+            url, params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    @override_settings(QUERY_PROFILER={
+        **settings.QUERY_PROFILER, 'ENABLED': True, 'STRICT': True})
+    async def test_read_endpoints(self):
+        response = await self.get('/api/recipes/', limit=2)
+        self.assertEqual(response.data['count'], 3)
+        self.assertIn('queries', response['Server-Timing'])
+        favorited = {
+            recipe['id']: recipe['is_favorited']
+            for recipe in response.data['results']}
+        self.assertTrue(favorited[self.recipes[0].id])
+
+        response = await self.get(f'/api/recipes/{self.recipes[1].id}/')
+        self.assertEqual(response.data['ingredients'][0]['name'], 'соль')
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+        response = await self.get('/api/ingredients/', name='со')
+        self.assertEqual(response.data[0]['name'], 'соль')
+
+        response = await self.get(
+            '/api/users/subscriptions/', recipes_limit=1)
+        self.assertEqual(response.data[0]['recipes_count'], 3)
+        self.assertEqual(len(response.data[0]['recipes']), 1)
+
+    async def test_anonymous_cached_and_writes_still_sync(self):
+        response = await self.async_client.get('/api/recipes/')
+        self.assertEqual(len(response.data), 3)
+        response = await self.async_client.get(
+            '/api/recipes/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.async_client.delete(
+            f'/api/recipes/{self.recipes[2].id}/', headers=self.headers)
+        self.assertEqual(response.status_code, 403)
+
+
+class ShoppingListMaintenanceTest(APITestCase):
+    def setUp(self):
+        self.user = create_user('cook')
+        self.other = create_user('other_cook')
+        self.sugar, self.milk, self.salt = Ingredient.objects.bulk_create([
+            Ingredient(name='сахар', measurement_unit='г'),
+            Ingredient(name='молоко', measurement_unit='мл'),
+            Ingredient(name='соль', measurement_unit='г'),
+        ])
+        self.recipes = create_recipes(
+            self.user, 2, [self.sugar, self.milk])
+
+    def shopping_list(self, user):
+        return dict(ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient__name', 'total_amount'))
+
+    def assertConsistent(self):
+        self.assertEqual(find_mismatches(), [])
+
+    def test_cart_changes_update_lists(self):
+        self.client.force_authenticate(self.other)
+        self.client.post(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.client.post(
+            '/api/recipes/shopping_cart/',
+            {'ids': [recipe.id for recipe in self.recipes]}, format='json')
+        self.assertEqual(
+            self.shopping_list(self.other), {'сахар': 10, 'молоко': 10})
+
+        self.client.delete(
+            f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(
+            self.shopping_list(self.other), {'сахар': 5, 'молоко': 5})
+        self.client.delete(
+            '/api/recipes/shopping_cart/',
+            {'ids': [self.recipes[1].id]}, format='json')
+        self.assertEqual(self.shopping_list(self.other), {})
+        self.assertConsistent()
+
+    def test_recipe_changes_update_lists(self):
+        for user in (self.user, self.other):
+            self.client.force_authenticate(user)
+            self.client.post(
+                f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(
+            f'/api/recipes/{self.recipes[0].id}/',
+            {'ingredients': [
+                {'id': self.sugar.id, 'amount': 7},
+                {'id': self.salt.id, 'amount': 1},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.shopping_list(self.other), {'сахар': 7, 'соль': 1})
+        self.assertConsistent()
+
+        self.client.delete(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(self.shopping_list(self.other), {})
+        self.assertConsistent()
+
+    def test_direct_ingredient_changes_update_lists(self):
+        self.client.force_authenticate(self.other)
+        self.client.post(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        item = RecipeIngredient.objects.get(
+            recipe=self.recipes[0], ingredient=self.sugar)
+        item.amount = 9
+        item.save()
+        RecipeIngredient.objects.create(
+            recipe=self.recipes[0], ingredient=self.salt, amount=2)
+        RecipeIngredient.objects.filter(
+            recipe=self.recipes[0], ingredient=self.milk).delete()
+        self.assertEqual(
+            self.shopping_list(self.other), {'сахар': 9, 'соль': 2})
+        self.assertConsistent()
+
+        self.salt.delete()
+        self.assertConsistent()
+
+    def test_rebuild_command(self):
+        self.user.shopping_card.add(*self.recipes)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_lists', '--verify',
+                         stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(
+            self.shopping_list(self.user), {'сахар': 10, 'молоко': 10})
+
+
+class ReadRepresentationContractTest(TestCase):
+    def setUp(self):
+        self.reader = create_user('contract_reader')
+        self.author = create_user('contract_author', avatar='users/ава 1.png')
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        self.recipes = create_recipes(self.author, 2, [ingredient])
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(
+            image='recipes/images/фото #1.png')
+        Favorite.objects.add(self.reader, self.recipes[0].id)
+        self.reader.subscriptions.add(self.author)
+
+    def render_both(self, user):
+        request = RequestFactory().get('/api/recipes/')
+        request.user = user
+        recipes = list(
+            Recipe.objects.with_related().with_user_flags(user).order_by('id'))
+        expected = RecipeSerializer(
+            recipes, many=True, context={'request': request}).data
+        media = MediaUrls(request)
+        rows = [recipe_row(recipe, media) for recipe in recipes]
+        return JSONRenderer().render(expected), rows
+
+    def test_rows_byte_identical_to_serializer(self):
+        for user in (self.reader, AnonymousUser()):
+            with self.subTest(user=user):
+                expected, rows = self.render_both(user)
+                self.assertEqual(JSONRenderer().render(rows), expected)
+                self.assertEqual(ORJSONRenderer().render(rows), expected)
+
+    def test_orjson_renderer_matches_drf(self):
+        data = {
+            'created': timezone.now(),
+            'price': Decimal('1.50'),
+            'detail': gettext_lazy('Страница не найдена.'),
+            1: [None, True, 'ё'],
+        }
+        self.assertEqual(
+            ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    @skipUnless(OPENAPI_SCHEMA.exists(), 'Нет docs/openapi-schema.yml')
+    def test_rows_cover_openapi_schema(self):
+        schema = yaml.safe_load(OPENAPI_SCHEMA.read_text(encoding='utf-8'))
+        schemas = schema['components']['schemas']
+        _, rows = self.render_both(self.reader)
+        row = rows[0]
+        for name, value in (
+            ('RecipeList', row),
+            ('User', row['author']),
+            ('IngredientInRecipe', row['ingredients'][0]),
+        ):
+            with self.subTest(schema=name):
+                self.assertLessEqual(
+                    set(schemas[name]['properties']), set(value))
+
+
+# Таймер сброса переходов не должен срабатывать посреди других тестов
+@override_settings(SHORT_LINK_HITS_FLUSH_INTERVAL=3600)
+class ShortLinkTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        short_links.local.clear()
+        hit_counter.flush()
+        author = create_user('short_link_author')
+        self.recipe = create_recipes(author, 1, [])[0]
+
+    def tearDown(self):
+        # Иначе буфер запишет atexit при завершении тестов, уже без базы
+        hit_counter.flush()
+
+    def test_codes_do_not_collide(self):
+        codes = {make_code(pk) for pk in range(1, 20001)}
+        self.assertEqual(len(codes), 20000)
+        self.assertEqual({len(code) for code in codes}, {6})
+        self.assertNotIn(make_code(62 ** 6), codes)
+
+    @override_settings(SHORT_LINK_HITS_FLUSH_SIZE=3)
+    def test_redirect_cached_and_hits_buffered(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/get-link/')
+        link = response.data['short-link']
+        code = ShortLink.objects.get(recipe=self.recipe).code
+        self.assertTrue(link.endswith(f'/s/{code}/'))
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/get-link/')
+        self.assertEqual(response.data['short-link'], link)
+
+        with CaptureQueriesContext(connection) as context:
+            first = self.client.get(f'/s/{code}')
+            second = self.client.get(f'/s/{code}/')
+        self.assertRedirects(
+            first, f'/recipes/{self.recipe.id}/',
+            fetch_redirect_response=False)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(ShortLink.objects.get(code=code).hits, 0)
+
+        with mock.patch.object(hit_counter, 'executor') as executor:
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(f'/s/{code}/')
+        # Запрос перехода не пишет в базу, пачка уходит в фоновый поток
+        self.assertEqual(len(context.captured_queries), 0)
+        executor.submit.assert_called_once_with(hit_counter.run_flush)
+        hit_counter.flush()
+        hit_counter.scheduled = False
+        self.assertEqual(ShortLink.objects.get(code=code).hits, 3)
+        self.assertEqual(self.client.get('/s/missing/').status_code, 404)
+
+    @override_settings(SHORT_LINK_HITS_FLUSH_INTERVAL=0)
+    def test_hits_flushed_by_timer(self):
+        code = get_short_link(self.recipe.id).code
+        with mock.patch.object(hit_counter, 'executor') as executor:
+            self.client.get(f'/s/{code}/')
+            hit_counter.timer.join()
+        executor.submit.assert_called_once_with(hit_counter.run_flush)
+        hit_counter.flush()
+        hit_counter.scheduled = False
+        self.assertEqual(ShortLink.objects.get(code=code).hits, 1)
+
+    def test_changed_code_forgotten(self):
+        link = get_short_link(self.recipe.id)
+        old_code = link.code
+        self.assertEqual(short_links.resolve(old_code), self.recipe.id)
+        link.code = 'edited'
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertEqual(self.client.get(f'/s/{old_code}/').status_code, 404)
+        self.assertEqual(short_links.resolve('edited'), self.recipe.id)
+
+
+class RecipeMatchTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        recipe_match_index.invalidate()
+        author = create_user('match_author')
+        self.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(4)
+        ])
+        first, second, third = self.ingredients[:3]
+        self.salad = create_recipes(author, 1, [first, second])[0]
+        self.soup = create_recipes(author, 1, [first, second, third])[0]
+        self.other = create_recipes(author, 1, [self.ingredients[3]])[0]
+
+    def have(self, ingredients, **params):
+        response = self.client.get('/api/recipes/', {
+            'have': ','.join(str(item.id) for item in ingredients),
+            **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data]
+
+    def test_ranked_by_missing_ingredients(self):
+        first, second = self.ingredients[:2]
+        self.assertEqual(
+            self.have([first, second]), [self.salad.id, self.soup.id])
+        self.assertEqual(
+            self.have([first, second], max_missing=0), [self.salad.id])
+        self.assertEqual(self.have([first], max_missing=0), [])
+
+    def test_index_follows_recipe_changes(self):
+        first, second, third = self.ingredients[:3]
+        self.assertEqual(
+            self.have([first, second], max_missing=0), [self.salad.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.other, ingredient=first, amount=1)
+            self.salad.delete()
+            self.soup.ingredient_amounts.filter(ingredient=third).delete()
+        cache.clear()
+        self.assertEqual(
+            self.have([first, second], max_missing=0), [self.soup.id])
+        self.assertEqual(
+            recipe_match_index.match([first.id], limit=10),
+            [(self.soup.id, 1, 1), (self.other.id, 1, 1)])
+
+    def test_cached_response_skips_match(self):
+        first, second = self.ingredients[:2]
+        self.have([first, second])
+        with mock.patch.object(
+                recipe_match_index, 'amatch',
+                wraps=recipe_match_index.amatch) as amatch:
+            self.assertEqual(
+                self.have([first, second]), [self.salad.id, self.soup.id])
+        amatch.assert_not_called()
+
+    def test_popular_ordering_rejected(self):
+        response = self.client.get('/api/recipes/', {
+            'have': self.ingredients[0].id, 'ordering': 'popular'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+
+
+class RecommendationsTest(APITestCase):
+    def setUp(self):
+        author = create_user('recommended_author')
+        self.recipes = create_recipes(author, 4, [])
+        first, second, third, fourth = self.recipes
+        self.users = [create_user(f'taster{i}') for i in range(3)]
+        # first и second почти всегда вместе, third - только у одного
+        for user, recipes in zip(self.users, [
+            [first, second], [first, second, third], [second, fourth],
+        ]):
+            for recipe in recipes[:-1]:
+                Favorite.objects.add(user, recipe.id)
+            ShoppingCartItem.objects.add(user, recipes[-1].id)
+
+    def test_similar_and_recommended(self):
+        out = StringIO()
+        call_command('build_recommendations', '--neighbours', 2, stdout=out)
+        self.assertIn('Пар похожих рецептов', out.getvalue())
+        first, second, third, fourth = self.recipes
+        self.assertEqual(
+            SimilarRecipe.objects.filter(recipe=first).count(), 2)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/recipes/{first.id}/similar/')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [second.id, third.id])
+        # Рецепт и соседи, у каждого ингредиенты через prefetch
+        self.assertEqual(len(context.captured_queries), 4)
+        response = self.client.get(f'/api/recipes/{fourth.id + 100}/similar/')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_authenticate(self.users[0])
+        response = self.client.get('/api/recipes/recommended/')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [third.id, fourth.id])
+
+    def test_jaccard_scores(self):
+        call_command(
+            'build_recommendations', '--metric', 'jaccard', stdout=StringIO())
+        first, second = self.recipes[:2]
+        # first у двух пользователей, second у трёх, вместе у двух
+        self.assertAlmostEqual(
+            SimilarRecipe.objects.get(recipe=first, similar=second).score,
+            2 / 3)
+
+
+class TimelineTest(APITestCase):
+    def setUp(self):
+        self.reader = create_user('reader')
+        self.author = create_user('writer')
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self):
+        response = self.client.post(
+            f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+
+    def feed(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_backfill_fan_out_and_prune(self):
+        old = create_recipes(self.author, 3, [])
+        with self.settings(TIMELINE_BACKFILL=2):
+            self.subscribe()
+        self.assertEqual(
+            [recipe['id'] for recipe in self.feed().data],
+            [old[2].id, old[1].id])
+
+        new = create_recipes(self.author, 1, [])[0]
+        self.author.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            publish(new)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=new).exists())
+
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed().data, [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_author_read_at_query_time(self):
+        self.subscribe()
+        recipes = create_recipes(self.author, 3, [])
+        self.author.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            publish(recipes[-1])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        response = self.feed(limit=2)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipes[2].id, recipes[1].id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipes[0].id])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_refilled_when_author_drops_below_limit(self):
+        early = create_user('early_reader')
+        Subscription.objects.add(early, self.author.id)
+        User.objects.filter(pk=self.author.id).update(subscribers_count=1)
+        # Подписка уже популярного автора: backfill его пропускает
+        self.subscribe()
+        recipe = create_recipes(self.author, 1, [])[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            publish(recipe)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        self.client.force_authenticate(early)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(
+            [item['id'] for item in self.feed().data], [recipe.id])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=recipe).exists())
+
+    def test_only_subscriptions(self):
+        other = create_user('stranger')
+        create_recipes(other, 1, [])
+        Subscription.objects.add(self.reader, other.id)
+        self.assertEqual(self.feed().data, [])
+        self.client.logout()
+        self.assertEqual(
+            self.client.get('/api/recipes/feed/').status_code, 401)
+
+
+class RecipeFilterTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        author = create_user('filter_author')
+        self.flour, self.egg, self.milk = Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'яйцо', 'молоко')
+        ])
+        self.bread, = create_recipes(author, 1, [self.flour])
+        self.omelette, = create_recipes(author, 1, [self.egg, self.milk])
+        self.pancakes, = create_recipes(
+            author, 1, [self.flour, self.egg, self.milk])
+        Recipe.objects.filter(pk=self.bread.pk).update(cooking_time=90)
+        Recipe.objects.filter(pk=self.pancakes.pk).update(cooking_time=30)
+
+    def ids(self, **params):
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {recipe['id'] for recipe in response.data}
+
+    def test_filters(self):
+        self.assertEqual(
+            self.ids(cooking_time_min=20, cooking_time_max=60),
+            {self.pancakes.id})
+        self.assertEqual(
+            self.ids(ingredients=f'{self.egg.id},{self.milk.id}'),
+            {self.omelette.id, self.pancakes.id})
+        self.assertEqual(
+            self.ids(ingredients=self.egg.id,
+                     exclude_ingredients=self.flour.id),
+            {self.omelette.id})
+        self.assertEqual(
+            self.ids(max_ingredients=2), {self.bread.id, self.omelette.id})
+        response = self.client.get('/api/recipes/', {'ingredients': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_ingredient_delete_updates_count(self):
+        self.milk.delete()
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.ingredients_count, 2)
+        Recipe.objects.update(ingredients_count=0)
+        Recipe.objects.update_ingredients_count()
+        self.assertEqual(
+            dict(Recipe.objects.values_list('id', 'ingredients_count')),
+            {self.bread.id: 1, self.omelette.id: 1, self.pancakes.id: 2})
+
+    def test_facets_in_one_cached_query(self):
+        url = (f'/api/recipes/facets/?cooking_time_max=60'
+               f'&facet_ingredients={self.flour.id},{self.egg.id}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [bucket['count'] for bucket in response.data['cooking_time']],
+            [1, 1, 0, 0])
+        self.assertEqual(
+            response.data['max_ingredients'][0], {'value': 3, 'count': 2})
+        self.assertEqual(response.data['ingredients'], [
+            {'id': self.flour.id, 'count': 1},
+            {'id': self.egg.id, 'count': 2},
+        ])
+
+        # Тот же набор фильтров в другом порядке берётся из кэша
+        with CaptureQueriesContext(connection) as context:
+            cached = self.client.get(
+                f'/api/recipes/facets/?facet_ingredients='
+                f'{self.flour.id},{self.egg.id}&cooking_time_max=60&limit=5')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(cached.data, response.data)
+
+        # Страницы одного набора фильтров делят одну запись кэша
+        with CaptureQueriesContext(connection) as context:
+            for offset in (10, 20):
+                cached = self.client.get(
+                    f'{url}&limit=10&offset={offset}&count=none')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(cached.data, response.data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=self.bread.pk).save()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        self.assertEqual(len(context.captured_queries), 1)
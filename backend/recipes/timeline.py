@@ -0,0 +1,95 @@
+"""Лента рецептов от авторов из подписок.
+
+У обычных авторов новый рецепт раскладывается по лентам подписчиков
+(fan-out on write) пачками по TIMELINE_BATCH_SIZE после коммита. Авторы
+с TIMELINE_FANOUT_LIMIT подписчиков и больше в ленты не пишутся, их
+рецепты подмешиваются при чтении (RecipeQuerySet.timeline).
+
+Когда у автора подписчиков становится меньше порога, его последние
+TIMELINE_BACKFILL рецептов раскладываются всем подписчикам: пока он был
+популярным, ленты для него не заполнялись. При переходе порога вверх
+ничего не нужно, все рецепты такого автора читаются напрямую.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def fan_out(recipe_id, author_id):
+    followers = Subscription.objects.filter(
+        author_id=author_id).order_by().values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=settings.TIMELINE_BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, recipe_id=recipe_id, author_id=author_id))
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def publish(recipe):
+    def run():
+        # Число подписчиков читается из базы после коммита: у автора из
+        # request.user оно может быть устаревшим
+        popular = User.objects.filter(
+            pk=recipe.author_id,
+            subscribers_count__gte=settings.TIMELINE_FANOUT_LIMIT,
+        ).exists()
+        if not popular:
+            fan_out(recipe.pk, recipe.author_id)
+
+    transaction.on_commit(run)
+
+
+def recent_recipes(author_ids):
+    return Recipe.objects.filter(author_id__in=author_ids).annotate(
+        position=Window(
+            RowNumber(), partition_by=F('author_id'),
+            order_by=F('id').desc(),
+        )).filter(position__lte=settings.TIMELINE_BACKFILL).order_by()
+
+
+def backfill(user, author_ids):
+    """Последние TIMELINE_BACKFILL рецептов новых авторов - в ленту."""
+    recipes = recent_recipes(User.objects.filter(
+        pk__in=author_ids,
+        subscribers_count__lt=settings.TIMELINE_FANOUT_LIMIT,
+    ).values('pk'))
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user=user, recipe_id=recipe_id, author_id=author_id)
+        for recipe_id, author_id in recipes.values_list('id', 'author_id')
+    ], ignore_conflicts=True)
+
+
+def refill_dropped(author_ids):
+    """Раскладывает рецепты авторов, только что опустившихся ниже порога.
+
+    Вызывается в транзакции сразу после уменьшения subscribers_count на
+    единицу: строки авторов заблокированы, поэтому переход через порог
+    видит ровно одна транзакция.
+    """
+    dropped = list(User.objects.filter(
+        pk__in=author_ids,
+        subscribers_count=settings.TIMELINE_FANOUT_LIMIT - 1,
+    ).values_list('pk', flat=True))
+    if not dropped:
+        return
+
+    def run():
+        recipes = recent_recipes(dropped).values_list('id', 'author_id')
+        for recipe_id, author_id in recipes:
+            fan_out(recipe_id, author_id)
+
+    transaction.on_commit(run)
+
+
+def prune(user, author_ids):
+    TimelineEntry.objects.filter(user=user, author_id__in=author_ids).delete()
@@ -1,7 +1,9 @@
 from rest_framework.routers import SimpleRouter
 from django.urls import re_path, include, path
 from . import views
-from .views import ShoppingCartAPIView, FavoriteAPIView
+from .views import (
+    ShoppingCartAPIView, FavoriteAPIView, DownloadShoppingCartView,
+    ShoppingCartBulkAPIView, FavoriteBulkAPIView)
 
 router = SimpleRouter()
 router.register(r'recipes', views.RecipeViewSet, basename='recipes')
@@ -10,7 +12,17 @@ router.register(r'ingredients', views.IngredientViewSet,
 
 urlpatterns = [
     path('recipes/download_shopping_cart/',
-         ShoppingCartAPIView.as_view(), name='download-shopping-list'),
+         DownloadShoppingCartView.as_view(), name='download-shopping-list'),
+    path(
+        'recipes/shopping_cart/',
+        ShoppingCartBulkAPIView.as_view(),
+        name='shopping-cart-bulk'
+    ),
+    path(
+        'recipes/favorite/',
+        FavoriteBulkAPIView.as_view(),
+        name='favorite-bulk'
+    ),
     path(
         'recipes/<int:pk>/shopping_cart/',
         ShoppingCartAPIView.as_view(),
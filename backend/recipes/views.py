@@ -1,160 +1,350 @@
-from rest_framework import viewsets, status
+from adrf.views import APIView as AsyncAPIView
+from adrf.viewsets import GenericViewSet
+from rest_framework import mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework import permissions
-from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCartItem
 from .serializers import (
     RecipeSerializer, IngredientSerializer)
+from backend.cache import CachedReadMixin
+from backend.images import MediaUrls
+from backend.serializers import BulkIdsSerializer, bulk_results
+from backend.pagination import KeysetPagination
 from backend.permissions import AuthorOrReadOnly
+from backend.views import AsyncReadMixin
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from rest_framework.negotiation import DefaultContentNegotiation
+from . import timeline
+from .autocomplete import ingredient_index
+from .facets import get_facets
+from .filters import RecipeFilter
+from .matching import match_recipes, recipe_match_index
+from .representations import recipe_row
+from .search import search_recipes
+from .short_links import get_short_link, hit_counter, short_links
+from .summaries import author_namespace
+from .shopping_list import (
+    RENDERERS, get_shopping_list, update_shopping_lists)
 
 User = get_user_model()
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedReadMixin, AsyncReadMixin,
+                    mixins.CreateModelMixin, mixins.UpdateModelMixin,
+                    mixins.DestroyModelMixin, GenericViewSet):
     permission_classes = [AuthorOrReadOnly]
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
+    cursor_ordering = ('name', 'id')
+    cache_namespace = 'recipes'
+    matches = None
 
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = RecipeFilter
 
     def get_queryset(self):
-        queryset = super().get_queryset()
         user = self.request.user
+        queryset = super().get_queryset().with_related().with_user_flags(user)
 
-        if user.is_authenticated:
-            is_favorited = self.request.query_params.get('is_favorited')
-            if is_favorited:
-                queryset = queryset.filter(id__in=user.favorites.values('id'))
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_recipes(queryset, search)
 
-            is_in_shopping_cart = self.request.query_params.get(
-                'is_in_shopping_cart')
-            if is_in_shopping_cart:
-                queryset = queryset.filter(
-                    id__in=user.shopping_card.values('id'))
+        if self.action == 'list' and self.matches is not None:
+            queryset = match_recipes(queryset, self.matches)
+            self.cursor_ordering = ('match_rank', 'id')
 
-        author_id = self.request.query_params.get('author')
-        if author_id:
-            queryset = queryset.filter(author__id=author_id)
+        if self.request.query_params.get('ordering') == 'popular':
+            # Обход индекса recipe_popularity_idx
+            self.cursor_ordering = ('-favorites_count', '-id')
+            queryset = queryset.order_by(*self.cursor_ordering)
 
         return queryset
 
+    async def list(self, request, *args, **kwargs):
+        # Подбор по ингредиентам выполняется внутри кэшируемого
+        # обработчика: ответ из кэша его не повторяет
+        return await self.cached_response(
+            self.get_list_namespaces(), self.match_and_list,
+            request, *args, **kwargs)
+
+    async def match_and_list(self, request, *args, **kwargs):
+        # ?have=1,5,9&max_missing=2: рецепты, для которых не хватает
+        # не больше max_missing ингредиентов, по индексу в памяти
+        self.matches = None
+        have = request.query_params.get('have')
+        if have is not None:
+            if request.query_params.get('ordering') == 'popular':
+                raise ValidationError(
+                    {'ordering': 'Подбор по ингредиентам (have) '
+                                 'упорядочен по совпадению, '
+                                 'ordering=popular с ним не совмещается.'})
+            max_missing = request.query_params.get('max_missing', '')
+            self.matches = await recipe_match_index.amatch(
+                [int(pk) for pk in have.split(',') if pk.strip().isdigit()],
+                int(max_missing) if max_missing.isdigit() else None,
+                settings.RECIPE_MATCH_LIMIT
+            )
+        return await AsyncReadMixin.list(self, request, *args, **kwargs)
+
+    def get_list_namespaces(self):
+        # Рецепты одного автора зависят только от его рецептов и профиля,
+        # правки чужих рецептов страницу автора не сбрасывают
+        author_id = self.request.query_params.get('author', '')
+        if author_id.isdigit():
+            return [author_namespace(author_id)]
+        return super().get_list_namespaces()
+
+    def represent(self, instance, many=False):
+        media = MediaUrls(self.request)
+        if many:
+            return [recipe_row(recipe, media) for recipe in instance]
+        return recipe_row(instance, media)
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        timeline.publish(recipe)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        # Счётчики для фильтров списка с теми же параметрами,
+        # ?facet_ingredients=1,5 добавляет счётчики по ингредиентам
+        ingredient_ids = [
+            int(pk) for pk in request.query_params.get(
+                'facet_ingredients', '').split(',')
+            if pk.strip().isdigit()
+        ]
+        queryset = self.filter_queryset(self.get_queryset())
+        # Избранное и корзина у каждого свои, такие счётчики не кэшируются
+        personal = request.user.is_authenticated and any(
+            request.query_params.get(name)
+            for name in ('is_favorited', 'is_in_shopping_cart'))
+        return Response(get_facets(
+            queryset, request.query_params, ingredient_ids,
+            cached=not personal))
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        # Лента подписок от новых к старым, ?cursor= листает дальше
+        self.cursor_ordering = ('-id',)
+        recipes = self.get_queryset().timeline(
+            request.user, settings.TIMELINE_FANOUT_LIMIT)
+        page = self.paginate_queryset(recipes)
+        if page is not None:
+            return self.get_paginated_response(
+                self.serialize(page, many=True))
+        return Response(self.serialize(list(recipes), many=True))
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        # Соседи из таблицы SimilarRecipe, её пересчитывает
+        # команда build_recommendations
+        recipe = self.get_object()
+        recipes = self.get_queryset().similar_to(recipe.id)
+        return Response(self.serialize(list(recipes), many=True))
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated])
+    def recommended(self, request):
+        # Рецепты из избранного и корзины уже загружены вместе с токеном
+        user = request.user
+        seed_ids = (
+            getattr(user, 'favorite_ids', None),
+            getattr(user, 'cart_ids', None),
+        )
+        if None in seed_ids:
+            seed_ids = (
+                user.favorite_items.values_list('recipe_id', flat=True),
+                user.shoppingcartitem_items.values_list(
+                    'recipe_id', flat=True),
+            )
+        seeds = set().union(*seed_ids)
+        self.cursor_ordering = ('-recommendation_score', 'id')
+        recipes = self.get_queryset().recommended(seeds)
+        page = self.paginate_queryset(recipes)
+        if page is not None:
+            return self.get_paginated_response(
+                self.serialize(page, many=True))
+        return Response(self.serialize(list(recipes), many=True))
 
     @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
         recipe = self.get_object()
-        link = request.build_absolute_uri(f'/recipes/{recipe.id}/')
+        code = get_short_link(recipe.id).code
+        link = request.build_absolute_uri(f'/s/{code}/')
 
         return Response({
             "short-link": link
         }, status=status.HTTP_200_OK)
 
 
-class ShoppingCartAPIView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+def short_link_redirect(request, code):
+    # Горячие ссылки отвечают из LRU процесса, переход пишется в буфер
+    recipe_id = short_links.resolve(code)
+    if recipe_id is None:
+        raise Http404
+    hit_counter.add(code)
+    return HttpResponseRedirect(f'/recipes/{recipe_id}/')
 
-    def get(self, request):
-        user = request.user
-        # Получаем все рецепты из списка покупок пользователя
-        recipes_in_cart = user.shopping_card.all()
-
-        # Получаем все ингредиенты для этих рецептов одним запросом
-        rec_ingredients = RecipeIngredient.objects.filter(
-            recipe__in=recipes_in_cart
-        ).select_related('ingredient')
-
-        ingredients = {}
-
-        for rec_ingr in rec_ingredients:
-            key = f"{rec_ingr.ingredient.name} ({rec_ingr.ingredient.measurement_unit})"
-
-            if key in ingredients:
-                ingredients[key]['amount'] += rec_ingr.amount
-            else:
-                ingredients[key] = {
-                    'amount': rec_ingr.amount,
-                    'measurement_unit': rec_ingr.ingredient.measurement_unit
-                }
-
-        lines = ["Список покупок:"]
-        for name, data in sorted(ingredients.items()):
-            lines.append(
-                f"{name} — {data['amount']}")
-
-        response = HttpResponse(
-            "\n".join(lines),
-            content_type='text/plain'
-        )
-        filename = "shopping_list.txt"
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-        return response
 
-    def post(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    # Параметр format выбирает формат файла, а не рендерер DRF
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
 
-        if request.user.shopping_card.filter(pk=recipe.pk).exists():
-            return Response(
-                {'detail': 'Рецепт уже в списке покупок'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
-        request.user.shopping_card.add(recipe)
-        serializer = RecipeSerializer(recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+async def stream(chunks):
+    for chunk in chunks:
+        yield chunk
 
-    def delete(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
 
-        if not request.user.shopping_card.filter(pk=recipe.pk).exists():
+class DownloadShoppingCartView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    content_negotiation_class = ShoppingListNegotiation
+
+    async def get(self, request):
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in RENDERERS:
             return Response(
-                {'detail': 'Рецепта нет в списке покупок'},
+                {'detail': 'Неизвестный формат списка покупок'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        request.user.shopping_card.remove(recipe)
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        # Строк не больше, чем разных ингредиентов, поэтому они читаются
+        # целиком, а файл отдаётся асинхронным потоком
+        render, content_type = RENDERERS[file_format]
+        rows = [row async for row in get_shopping_list(request.user)]
+        response = StreamingHttpResponse(
+            stream(render(rows)), content_type=content_type)
+        filename = f"shopping_list.{file_format}"
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
 
 
-class FavoriteAPIView(APIView):
+class RecipeRelationAPIView(APIView):
+    """Добавление рецепта в список пользователя и удаление из него.
+
+    Каждое действие - один INSERT или DELETE, ответ 400/404 выводится
+    из того, изменилась ли строка.
+    """
+
     permission_classes = [permissions.IsAuthenticated]
+    model = None
+    counter_field = None
+    already_added_message = None
+    not_added_message = None
+
+    def after_change(self, user, recipe_ids, delta):
+        if self.counter_field:
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                **{self.counter_field: F(self.counter_field) + delta})
 
     def post(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
+        with transaction.atomic():
+            added = self.model.objects.add(request.user, pk)
+            if added:
+                self.after_change(request.user, [pk], 1)
 
-        if request.user.favorites.filter(pk=recipe.pk).exists():
+        if not added:
+            get_object_or_404(Recipe, pk=pk)
             return Response(
-                {'detail': 'Рецепт уже в избранном'},
+                {'detail': self.already_added_message},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        request.user.favorites.add(recipe)
+        recipe = Recipe.objects.with_related().get(pk=pk)
         serializer = RecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
+        with transaction.atomic():
+            removed = self.model.objects.remove(request.user, pk)
+            if removed:
+                self.after_change(request.user, [pk], -1)
 
-        if not request.user.favorites.filter(pk=recipe.pk).exists():
+        if not removed:
+            get_object_or_404(Recipe, pk=pk)
             return Response(
-                {'detail': 'Рецепта нет в избранном'},
+                {'detail': self.not_added_message},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        request.user.favorites.remove(recipe)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class BulkRecipeRelationMixin:
+    """Пакетная синхронизация: {"ids": [...]} вместо запроса на рецепт."""
+
+    def change_many(self, request, method, delta, success_status):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            states = method(request.user, serializer.validated_data['ids'])
+            changed = [pk for pk, state in states.items() if state]
+            if changed:
+                self.after_change(request.user, changed, delta)
+
+        message = (
+            self.already_added_message if delta > 0
+            else self.not_added_message
+        )
+        return Response(
+            {'results': bulk_results(states, success_status, message)})
+
+    def post(self, request):
+        return self.change_many(
+            request, self.model.objects.add_many, 1, status.HTTP_201_CREATED)
+
+    def delete(self, request):
+        return self.change_many(
+            request, self.model.objects.remove_many, -1,
+            status.HTTP_204_NO_CONTENT)
+
+
+class ShoppingCartAPIView(RecipeRelationAPIView):
+    model = ShoppingCartItem
+    already_added_message = 'Рецепт уже в списке покупок'
+    not_added_message = 'Рецепта нет в списке покупок'
+
+    def after_change(self, user, recipe_ids, delta):
+        update_shopping_lists(recipe_ids, delta, user=user)
+
+
+class FavoriteAPIView(RecipeRelationAPIView):
+    model = Favorite
+    counter_field = 'favorites_count'
+    already_added_message = 'Рецепт уже в избранном'
+    not_added_message = 'Рецепта нет в избранном'
+
+
+class ShoppingCartBulkAPIView(BulkRecipeRelationMixin, ShoppingCartAPIView):
+    pass
+
+
+class FavoriteBulkAPIView(BulkRecipeRelationMixin, FavoriteAPIView):
+    pass
+
+
+class IngredientViewSet(CachedReadMixin, AsyncReadMixin,
+                        mixins.CreateModelMixin, mixins.UpdateModelMixin,
+                        mixins.DestroyModelMixin, GenericViewSet):
     permission_classes = [AuthorOrReadOnly]
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
+    cursor_ordering = ('name', 'id')
+    cache_namespace = 'ingredients'
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -162,10 +352,25 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['^name']
 
+    async def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        cursor = 'cursor' in request.query_params
+        if not name or cursor or not settings.INGREDIENT_INDEX_ENABLED:
+            return await super().list(request, *args, **kwargs)
+
+        # Автодополнение отвечает из индекса в памяти, без запроса к базе
+        ingredients = await ingredient_index.asearch(name)
+        page = self.paginate_queryset(ingredients)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(ingredients)
+
     def get_queryset(self):
         queryset = Ingredient.objects.all()
         name = self.request.query_params.get('name', None)
 
         if name:
-            queryset = queryset.filter(name__istartswith=name)
+            # На PostgreSQL использует индекс по LOWER(name)
+            queryset = queryset.annotate(name_lower=Lower('name')).filter(
+                name_lower__startswith=name.lower())
         return queryset
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import CustomUser
+from backend.admin import ReadOnlyAdmin
+from .models import CustomUser, Subscription
 
 admin.site.register(CustomUser)
+admin.site.register(Subscription, ReadOnlyAdmin)
@@ -0,0 +1,133 @@
+"""Переносит избранное, корзину и подписки в модели с created_at.
+
+Связи из автоматических таблиц users_customuser_favorites,
+users_customuser_shopping_card и users_customuser_subscriptions
+копируются в recipes.Favorite, recipes.ShoppingCartItem и
+users.Subscription с created_at на момент миграции, старые таблицы
+удаляются. Затем заполняются счётчики и списки покупок.
+"""
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+# Поле пользователя -> (модель связи, поле цели в ней)
+RELATIONS = {
+    'favorites': ('recipes.Favorite', 'recipe'),
+    'shopping_card': ('recipes.ShoppingCartItem', 'recipe'),
+    'subscriptions': ('users.Subscription', 'author'),
+}
+
+
+def auto_through(apps, name):
+    field = apps.get_model('users', 'CustomUser')._meta.get_field(name)
+    through = field.remote_field.through
+    return (through, field.m2m_field_name() + '_id',
+            field.m2m_reverse_field_name() + '_id')
+
+
+def copy_to_through_models(apps, schema_editor):
+    now = timezone.now()
+    for name, (label, target) in RELATIONS.items():
+        through, user_column, target_column = auto_through(apps, name)
+        model = apps.get_model(label)
+        rows = through.objects.values_list(user_column, target_column)
+        if name == 'subscriptions':
+            rows = rows.exclude(**{user_column: F(target_column)})
+        batch = []
+        for user_id, target_id in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append(model(
+                user_id=user_id, created_at=now,
+                **{f'{target}_id': target_id}))
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+
+def copy_to_auto_tables(apps, schema_editor):
+    for name, (label, target) in RELATIONS.items():
+        through, user_column, target_column = auto_through(apps, name)
+        links = apps.get_model(label).objects.all()
+        through.objects.bulk_create([
+            through(**{user_column: user_id, target_column: target_id})
+            for user_id, target_id in links.values_list(
+                'user_id', f'{target}_id').iterator(chunk_size=BATCH_SIZE)
+        ], batch_size=BATCH_SIZE)
+        links.delete()
+
+
+def count_rows(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(
+        favorites_count=count_rows(
+            apps.get_model('recipes', 'Favorite'), 'recipe'),
+        ingredients_count=count_rows(
+            apps.get_model('recipes', 'RecipeIngredient'), 'recipe'),
+    )
+    apps.get_model('users', 'CustomUser').objects.update(
+        subscribers_count=count_rows(
+            apps.get_model('users', 'Subscription'), 'author'))
+
+
+def fill_shopping_lists(apps, schema_editor):
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    rows = (
+        apps.get_model('recipes', 'ShoppingCartItem').objects
+        .filter(recipe__ingredient_amounts__isnull=False)
+        .values('user_id',
+                ingredient_id=F('recipe__ingredient_amounts__ingredient'))
+        .annotate(total=Sum('recipe__ingredient_amounts__amount'))
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(
+            user_id=row['user_id'], ingredient_id=row['ingredient_id'],
+            total_amount=row['total'])
+        for row in rows.iterator(chunk_size=BATCH_SIZE)
+    ], batch_size=BATCH_SIZE)
+
+
+def clear_shopping_lists(apps, schema_editor):
+    apps.get_model('recipes', 'ShoppingListItem').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_relations_and_indexes'),
+        ('users', '0002_subscription'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_to_through_models, copy_to_auto_tables),
+        migrations.RemoveField(model_name='customuser', name='favorites'),
+        migrations.RemoveField(model_name='customuser', name='shopping_card'),
+        migrations.RemoveField(model_name='customuser', name='subscriptions'),
+        migrations.AddField(
+            model_name='customuser',
+            name='favorites',
+            field=models.ManyToManyField(blank=True, related_name='favorite_recipes', through='recipes.Favorite', to='recipes.recipe', verbose_name='Избранное'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='shopping_card',
+            field=models.ManyToManyField(blank=True, related_name='shopping_card', through='recipes.ShoppingCartItem', to='recipes.recipe', verbose_name='Список покупок'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='subscriptions',
+            field=models.ManyToManyField(blank=True, related_name='subscribers', through='users.Subscription', through_fields=('user', 'author'), to='users.customuser', verbose_name='Подписки'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.RunPython(fill_shopping_lists, clear_shopping_lists),
+    ]
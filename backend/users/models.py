@@ -1,7 +1,7 @@
 from django.db import models
-from django.db import models
-from django.contrib.auth.models import (
-    AbstractUser, PermissionsMixin)
+from django.contrib.auth.models import AbstractUser, PermissionsMixin
+
+from backend.querysets import RelationQuerySet
 
 
 class CustomUser(AbstractUser, PermissionsMixin):
@@ -19,13 +19,18 @@ class CustomUser(AbstractUser, PermissionsMixin):
         'self',
         verbose_name="Подписки",
         symmetrical=False,
+        through='Subscription',
+        through_fields=('user', 'author'),
         related_name='subscribers',
         blank=True,
     )
+    subscribers_count = models.PositiveIntegerField(
+        "Подписчиков", default=0, editable=False)
 
     favorites = models.ManyToManyField(
         'recipes.Recipe',
         verbose_name="Избранное",
+        through='recipes.Favorite',
         related_name='favorite_recipes',
         blank=True
     )
@@ -33,6 +38,7 @@ class CustomUser(AbstractUser, PermissionsMixin):
     shopping_card = models.ManyToManyField(
         'recipes.Recipe',
         verbose_name="Список покупок",
+        through='recipes.ShoppingCartItem',
         related_name='shopping_card',
         blank=True
     )
@@ -46,3 +52,55 @@ class CustomUser(AbstractUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # Пользователь из кэша токенов загружен с отложенными полями:
+        # первое обращение к любому из них читает их все одним запросом
+        if fields is not None:
+            deferred = self.get_deferred_fields()
+            if deferred.intersection(fields):
+                fields = deferred.union(fields)
+        super().refresh_from_db(using, fields, **kwargs)
+
+
+class Subscription(models.Model):
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name="Подписчик",
+        on_delete=models.CASCADE,
+        related_name='subscription_items'
+    )
+    author = models.ForeignKey(
+        CustomUser,
+        verbose_name="Автор",
+        on_delete=models.CASCADE,
+        related_name='subscriber_items'
+    )
+    created_at = models.DateTimeField("Подписан", auto_now_add=True)
+
+    objects = RelationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Подписка"
+        verbose_name_plural = "Подписки"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_subscription'
+            ),
+            models.CheckConstraint(
+                condition=~models.Q(user=models.F('author')),
+                name='no_self_subscription'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'created_at'],
+                name='subscription_user_time_idx'
+            ),
+            models.Index(fields=['author'], name='subscription_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} -> {self.author}'
@@ -0,0 +1,24 @@
+"""Быстрый путь сериализации пользователей, см. recipes.representations."""
+
+
+def user_row(user, media, is_subscribed):
+    return {
+        'email': user.email,
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'avatar': media.file_url(user.avatar),
+        'avatar_thumbnails': media.thumbnails(user.avatar, 'avatar'),
+        'is_subscribed': is_subscribed,
+    }
+
+
+def subscription_row(user, media, summary):
+    """Автор из подписок; summary - из recipes.summaries."""
+    from recipes.representations import summary_row
+    row = user_row(user, media, True)
+    row['recipes'] = [
+        summary_row(recipe, media) for recipe in summary['recipes']]
+    row['recipes_count'] = summary['count']
+    return row
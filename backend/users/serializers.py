@@ -1,6 +1,7 @@
 # from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
+from backend.images import thumbnail_urls
 from backend.serializers import Base64ImageField
 
 User = get_user_model()
@@ -22,12 +23,13 @@ class AvatarSerializer(serializers.ModelSerializer):
 
 class CustomUserViewSerializer(serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField()
+    avatar_thumbnails = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name',
-                  'last_name', 'avatar', 'is_subscribed')
+                  'last_name', 'avatar', 'avatar_thumbnails', 'is_subscribed')
 
     def get_avatar(self, obj):
         request = self.context.get('request')
@@ -35,9 +37,19 @@ class CustomUserViewSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.avatar.url)
         return None
 
+    def get_avatar_thumbnails(self, obj):
+        return thumbnail_urls(
+            obj.avatar, 'avatar', self.context.get('request'))
+
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            # Множество загружает CachedTokenAuthentication
+            ids = getattr(request.user, 'subscription_ids', None)
+            if ids is not None:
+                return obj.pk in ids
             return request.user.subscriptions.filter(pk=obj.pk).exists()
         return False
 
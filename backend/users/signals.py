@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from backend.authentication import token_cache
+from backend.images import schedule_thumbnails
+from recipes import timeline
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_avatar_thumbnails(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if instance.avatar:
+        schedule_thumbnails(instance.avatar.name, 'avatar')
+
+
+@receiver(pre_delete, sender=User)
+def update_counters_on_user_delete(sender, instance, **kwargs):
+    # Каскадное удаление избранного и подписок идёт мимо RelationQuerySet
+    Recipe.objects.filter(favorite_items__user=instance).update(
+        favorites_count=F('favorites_count') - 1)
+    author_ids = list(User.objects.filter(
+        subscriber_items__user=instance).values_list('pk', flat=True))
+    User.objects.filter(pk__in=author_ids).update(
+        subscribers_count=F('subscribers_count') - 1)
+    timeline.refill_dropped(author_ids)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_token_cache(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    # После удаления Django обнуляет pk, а key и есть pk токена
+    key = instance.key
+    token_cache.forget(key)
+    transaction.on_commit(lambda: token_cache.forget(key))
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.favorites.through)
+@receiver(m2m_changed, sender=User.shopping_card.through)
+@receiver(m2m_changed, sender=User.subscriptions.through)
+def invalidate_relations_token_cache(sender, instance, action, reverse,
+                                     pk_set, **kwargs):
+    # Изменения через менеджеры M2M (admin, user.subscriptions.add);
+    # API меняет связи через RelationQuerySet, который сбрасывает кэш сам
+    if not action.startswith('post_'):
+        return
+    user_ids = (pk_set or ()) if reverse else [instance.pk]
+    for pk in user_ids:
+        token_cache.invalidate_user(pk)
@@ -4,8 +4,17 @@ from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Recipe
+from backend.authentication import token_cache
+from backend.images import MediaUrls
+from users.models import Subscription
+from recipes.summaries import get_author_summaries
+from users.representations import subscription_row
 
 CHEL = {
     "username": "bob",
@@ -107,3 +116,253 @@ class LogoutViewTest(APITestCase):
 
         # Проверяем, что токен был удален
         self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(**CHEL)
+        self.client.force_authenticate(self.user)
+        self.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@user.com',
+                password='foo')
+            for i in range(6)
+        ]
+        Recipe.objects.bulk_create([
+            Recipe(author=author, name=f'Рецепт {i}',
+                   image='recipes/images/test.png', text='описание',
+                   cooking_time=5)
+            for author in self.authors
+            for i in range(4)
+        ])
+
+    def get_subscriptions(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data
+
+    def test_query_count_does_not_depend_on_page(self):
+        self.user.subscriptions.add(self.authors[0])
+        small, _ = self.get_subscriptions(limit=2, recipes_limit=1)
+
+        self.user.subscriptions.add(*self.authors[1:])
+        large, data = self.get_subscriptions(limit=6, recipes_limit=3)
+
+        self.assertEqual(small, large)
+        self.assertEqual(data['count'], 6)
+        for author in data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], 4)
+            self.assertEqual(len(author['recipes']), 3)
+
+
+class SubscribersCountTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(**CHEL)
+        self.author = User.objects.create_user(
+            username='author', email='author@user.com', password='foo')
+        self.client.force_authenticate(self.user)
+
+    def test_counter_follows_subscriptions(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertTrue(Subscription.objects.filter(
+            user=self.user, author=self.author).exists())
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(
+            self.client.post(f'/api/users/{self.user.id}/subscribe/')
+            .status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 0)
+
+
+class SubscriptionsBulkTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(**CHEL)
+        self.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@user.com',
+                password='foo')
+            for i in range(3)
+        ]
+        self.client.force_authenticate(self.user)
+
+    def test_per_item_results(self):
+        ids = [self.authors[0].id, self.user.id, self.authors[1].id, 999]
+        response = self.client.post(
+            '/api/users/subscribe/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['id'], item['status'])
+             for item in response.data['results']],
+            [(ids[0], 201), (ids[1], 400), (ids[2], 201), (999, 404)])
+        self.authors[0].refresh_from_db()
+        self.assertEqual(self.authors[0].subscribers_count, 1)
+
+        response = self.client.delete(
+            '/api/users/subscribe/',
+            {'ids': [self.authors[0].id, self.authors[2].id]},
+            format='json')
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            [204, 400])
+        self.assertEqual(
+            list(self.user.subscriptions.values_list('id', flat=True)),
+            [self.authors[1].id])
+
+
+class SubscriptionRepresentationContractTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(
+            username='contract_user', email='contract_user@user.com',
+            password='foo')
+        self.author = User.objects.create_user(
+            username='contract_author', email='contract_author@user.com',
+            password='foo', avatar='users/ava.png')
+        Recipe.objects.bulk_create([
+            Recipe(author=self.author, name=f'Рецепт {i}',
+                   image='recipes/images/test.png', text='описание',
+                   cooking_time=10)
+            for i in range(3)
+        ])
+        Subscription.objects.add(self.user, self.author.id)
+
+    def test_rows_match_api_fields(self):
+        request = RequestFactory().get('/api/users/subscriptions/')
+        request.user = self.user
+        summaries = get_author_summaries([self.author.id], 2)
+        row = subscription_row(
+            self.author, MediaUrls(request), summaries[self.author.id])
+
+        self.assertEqual(list(row), [
+            'email', 'id', 'username', 'first_name', 'last_name', 'avatar',
+            'avatar_thumbnails', 'is_subscribed', 'recipes', 'recipes_count'])
+        self.assertEqual(row['recipes_count'], 3)
+        self.assertTrue(row['is_subscribed'])
+        self.assertEqual(
+            row['avatar'], 'http://testserver/media/users/ava.png')
+        self.assertEqual(
+            [recipe['name'] for recipe in row['recipes']],
+            ['Рецепт 0', 'Рецепт 1'])
+        self.assertEqual(list(row['recipes'][0]), [
+            'id', 'name', 'image', 'cooking_time'])
+
+
+class AuthorRecipesCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(**CHEL)
+        self.author = User.objects.create_user(
+            username='cached_author', email='cached_author@user.com',
+            password='foo')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image='recipes/images/a.png',
+            text='описание', cooking_time=5)
+        self.user.subscriptions.add(self.author)
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/subscriptions/')
+        recipe_queries = [
+            query for query in context.captured_queries
+            if 'recipes_recipe' in query['sql']]
+        return response.data[0], len(recipe_queries)
+
+    def test_summaries_cached_until_author_recipes_change(self):
+        author, queries = self.get_subscriptions()
+        self.assertEqual(author['recipes_count'], 1)
+        self.assertEqual(queries, 2)
+
+        _, queries = self.get_subscriptions()
+        self.assertEqual(queries, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.author, name='Ещё рецепт',
+                image='recipes/images/b.png', text='описание',
+                cooking_time=5)
+        author, queries = self.get_subscriptions()
+        self.assertEqual(author['recipes_count'], 2)
+        self.assertEqual(
+            [recipe['name'] for recipe in author['recipes']],
+            ['Ещё рецепт', 'Рецепт'])
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(**CHEL)
+        self.author = User.objects.create_user(
+            username='token_author', email='token_author@user.com',
+            password='foo')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def test_token_and_relations_cached(self):
+        self.get('/api/users/me/')
+        response, queries = self.get(f'/api/users/{self.author.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_subscribed'])
+        self.assertFalse(
+            [sql for sql in queries if 'authtoken_token' in sql
+             or 'users_subscription' in sql])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        response, _ = self.get(f'/api/users/{self.author.id}/')
+        self.assertTrue(response.data['is_subscribed'])
+
+    def test_logout_invalidates_token(self):
+        self.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        response, _ = self.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_rejected(self):
+        self.get('/api/users/me/')
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, _ = self.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_keeps_no_credentials(self):
+        self.get('/api/users/me/')
+        digest = token_cache.digest(self.token.key)
+        entry = cache.get(token_cache.token_key(digest))
+        self.assertEqual(entry['id'], self.user.id)
+        self.assertNotIn('password', entry)
+        self.assertIsNone(cache.get(f'auth-token:{self.token.key}'))
+
+    def test_profile_read_fresh(self):
+        self.get('/api/users/me/')
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            first_name='Свежее')
+        response, queries = self.get('/api/users/me/')
+        self.assertEqual(response.data['first_name'], 'Свежее')
+        self.assertEqual(
+            len([sql for sql in queries if 'users_customuser' in sql]), 1)
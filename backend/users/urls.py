@@ -1,11 +1,14 @@
 from django.urls import include, path
 
 from .views import (CustomAuthToken, LogoutView, AvatarView,
-                    UserDetailView, UserListView, SubscriptionsView)
+                    UserDetailView, UserListView, SubscriptionsView,
+                    SubscriptionsBulkView, SubscriptionListView)
 
 urlpatterns = [
     path('users/subscriptions/',
-         SubscriptionsView.as_view(), name='subscriptions'),
+         SubscriptionListView.as_view(), name='subscriptions'),
+    path('users/subscribe/',
+         SubscriptionsBulkView.as_view(), name='subscriptions_bulk'),
     path('users/<int:id>/subscribe/',
          SubscriptionsView.as_view(), name='subscriptions_manager'),
     path('users/me/avatar/', AvatarView.as_view(), name='user_avatar'),
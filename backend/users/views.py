@@ -1,3 +1,4 @@
+from adrf.views import APIView as AsyncAPIView
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.authtoken.models import Token
 from rest_framework import status
@@ -12,8 +13,18 @@ from django.contrib.auth import get_user_model
 from rest_framework.permissions import AllowAny
 from backend.permissions import GetOnly
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F
 from django.shortcuts import get_object_or_404
-from rest_framework.pagination import LimitOffsetPagination
+from backend.authentication import token_cache
+from backend.images import MediaUrls
+from backend.middleware import serializer_timing
+from backend.pagination import KeysetPagination
+from backend.serializers import BulkIdsSerializer, bulk_results
+from recipes import timeline
+from recipes.summaries import aget_author_summaries, get_author_summaries
+from .models import Subscription
+from .representations import subscription_row
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 
 User = get_user_model()
@@ -47,89 +58,130 @@ class AvatarView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SubscriptionsView(APIView):
+class SubscriptionListView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
 
-    def get(self, request):
-        subscriptions = request.user.subscriptions.all()
+    async def get(self, request):
+        recipes_limit = int(request.query_params.get('recipes_limit', 3))
+        subscriptions = request.user.subscriptions.order_by('id')
 
         paginator = self.pagination_class()
-        paginated_subscriptions = paginator.paginate_queryset(
-            subscriptions, request)
-
-        user_data = CustomUserViewSerializer(
-            paginated_subscriptions,
-            many=True,
-            context={'request': request}
-        ).data
+        paginated_subscriptions = await paginator.apaginate_queryset(
+            subscriptions, request, view=self)
+        authors = (
+            paginated_subscriptions
+            if paginated_subscriptions is not None
+            else [user async for user in subscriptions]
+        )
+
+        # Карточки рецептов авторов берутся из кэша по авторам
+        summaries = await aget_author_summaries(
+            [author.id for author in authors], recipes_limit)
+        with serializer_timing(request):
+            media = MediaUrls(request)
+            user_data = [
+                subscription_row(author, media, summaries[author.id])
+                for author in authors
+            ]
+
+        if paginated_subscriptions is None:
+            return Response(user_data)
+        return paginator.get_paginated_response(user_data)
 
-        from recipes.serializers import ShortRecipeSerializer
-        from recipes.models import Recipe
-        recipes_limit = int(request.query_params.get('recipes_limit', 3))
-        for user in user_data:
-            recipes = Recipe.objects.filter(author__id=user['id'])[
-                :recipes_limit]
-            user['recipes'] = ShortRecipeSerializer(recipes, many=True).data
-            user['recipes_count'] = Recipe.objects.filter(
-                author__id=user['id']).count()
 
-        return paginator.get_paginated_response(user_data)
+class SubscriptionsView(APIView):
+    permission_classes = [IsAuthenticated]
 
     def post(self, request, id):
         user = request.user
-        subscriber = get_object_or_404(User, pk=id)
-
-        if subscriber in user.subscriptions.all():
+        if id == user.pk:
             return Response(
-                {"detail": "Нельзя подписаться дважды"},
+                {"detail": "Нельзя подписаться на самого себя"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if subscriber == user:
+        with transaction.atomic():
+            added = Subscription.objects.add(user, id)
+            if added:
+                User.objects.filter(pk=id).update(
+                    subscribers_count=F('subscribers_count') + 1)
+                timeline.backfill(user, [id])
+
+        if not added:
+            get_object_or_404(User, pk=id)
             return Response(
-                {"detail": "Нельзя подписаться на самого себя"},
+                {"detail": "Нельзя подписаться дважды"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user.subscriptions.add(subscriber)
-        user.save()
-
-        serializer = CustomUserViewSerializer(
-            subscriber, context={'request': request})
-        response_data = serializer.data
-
-        from recipes.serializers import ShortRecipeSerializer
-        from recipes.models import Recipe
         recipes_limit = int(request.query_params.get('recipes_limit', 3))
-        recipes = Recipe.objects.filter(author=subscriber)[:recipes_limit]
-        response_data['recipes'] = ShortRecipeSerializer(
-            recipes, many=True).data
-        response_data['recipes_count'] = Recipe.objects.filter(
-            author=subscriber).count()
-
-        return Response(response_data, status=status.HTTP_201_CREATED)
+        author = User.objects.get(pk=id)
+        summary = get_author_summaries([id], recipes_limit)[id]
+        return Response(
+            subscription_row(author, MediaUrls(request), summary),
+            status=status.HTTP_201_CREATED
+        )
 
     def delete(self, request, id):
-        user = request.user
-        subscriber = get_object_or_404(User, pk=id)
-
-        if subscriber not in user.subscriptions.all():
+        with transaction.atomic():
+            removed = Subscription.objects.remove(request.user, id)
+            if removed:
+                User.objects.filter(pk=id).update(
+                    subscribers_count=F('subscribers_count') - 1)
+                timeline.prune(request.user, [id])
+                timeline.refill_dropped([id])
+
+        if not removed:
+            get_object_or_404(User, pk=id)
             return Response(
                 {"detail": "Нельзя отписаться от того, на кого не подписан"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if subscriber == user:
-            return Response(
-                {"detail": "Нельзя отписаться и подписаться на самого себя"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        user.subscriptions.remove(subscriber)
-        user.save()
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+class SubscriptionsBulkView(APIView):
+    """Пакетная подписка и отписка: {"ids": [...]}."""
+
+    permission_classes = [IsAuthenticated]
+
+    def change_many(self, request, method, delta, success_status, message):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+
+        with transaction.atomic():
+            states = method(user, [pk for pk in ids if pk != user.pk])
+            changed = [pk for pk, state in states.items() if state]
+            if changed:
+                User.objects.filter(pk__in=changed).update(
+                    subscribers_count=F('subscribers_count') + delta)
+                if delta > 0:
+                    timeline.backfill(user, changed)
+                else:
+                    timeline.prune(user, changed)
+                    timeline.refill_dropped(changed)
+
+        results = bulk_results(states, success_status, message)
+        if user.pk in ids:
+            results.insert(ids.index(user.pk), {
+                'id': user.pk, 'status': status.HTTP_400_BAD_REQUEST,
+                'detail': 'Нельзя подписаться на самого себя'})
+        return Response({'results': results})
+
+    def post(self, request):
+        return self.change_many(
+            request, Subscription.objects.add_many, 1,
+            status.HTTP_201_CREATED, 'Нельзя подписаться дважды')
+
+    def delete(self, request):
+        return self.change_many(
+            request, Subscription.objects.remove_many, -1,
+            status.HTTP_204_NO_CONTENT,
+            'Нельзя отписаться от того, на кого не подписан')
 
 
 class CustomAuthToken(ObtainAuthToken):
@@ -142,6 +194,9 @@ class CustomAuthToken(ObtainAuthToken):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
+        # Вход перечитывает пользователя и его связи при следующем запросе
+        token_cache.forget(token.key)
+        token_cache.invalidate_user(user.pk)
         return Response({
             'auth_token': token.key
         })